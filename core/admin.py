@@ -1,8 +1,10 @@
 from django.contrib import admin
-from .models import Course, Video, Enrollment, Note
+from .models import Course, Video, Enrollment, Note, VideoSummary, VideoChapter
 
 admin.site.register(Course)
 admin.site.register(Video)
 admin.site.register(Enrollment)
 admin.site.register(Note)
+admin.site.register(VideoSummary)
+admin.site.register(VideoChapter)
 
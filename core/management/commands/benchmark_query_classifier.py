@@ -0,0 +1,61 @@
+import time
+from django.core.management.base import BaseCommand
+from engine.rag.chains import get_query_type_classifier_chain
+from engine.rag.query_classifier import classify_query, load_labelled_queries, get_label_centroids
+
+
+class Command(BaseCommand):
+    help = 'Measures accuracy and latency of the local query classifier (and optionally the LLM classifier) on the labelled query set.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--split', default='test', choices=['train', 'test', 'all'], help='Which labelled examples to score.')
+        parser.add_argument('--llm', action='store_true', help='Also run the LLM classifier chain for comparison.')
+
+    def handle(self, *args, **options):
+        split = None if options['split'] == 'all' else options['split']
+        examples = load_labelled_queries(split)
+        self.stdout.write(f'Scoring {len(examples)} labelled queries ({options["split"]} split)...')
+
+        # Build centroids up front so their one-off cost isn't charged to the first query
+        warmup_start = time.perf_counter()
+        get_label_centroids()
+        self.stdout.write(f'Centroids ready in {(time.perf_counter() - warmup_start) * 1000:.0f} ms')
+
+        llm_chain = get_query_type_classifier_chain()
+
+        self._report('Local (no LLM fallback)', examples, lambda q: classify_query(q).label)
+        self._report('Local + LLM fallback', examples, lambda q: classify_query(q, llm_fallback=llm_chain).label)
+
+        if options['llm']:
+            def classify_with_llm(query):
+                answer = llm_chain.invoke({"question": query}).strip()
+                if "Fetch_Notes" in answer:
+                    return "Fetch_Notes"
+                if "General" in answer:
+                    return "General"
+                return "RAG"
+            self._report('LLM chain', examples, classify_with_llm)
+
+    def _report(self, name, examples, classify):
+        latencies = []
+        correct = 0
+        for example in examples:
+            start = time.perf_counter()
+            try:
+                label = classify(example['query'])
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f'  {name}: failed on "{example["query"]}": {e}'))
+                label = None
+            latencies.append((time.perf_counter() - start) * 1000)
+            if label == example['label']:
+                correct += 1
+            else:
+                self.stdout.write(f'  [{name}] miss: "{example["query"]}" -> {label} (expected {example["label"]})')
+
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(self.style.SUCCESS(
+            f'{name}: accuracy {correct}/{len(examples)} ({correct / len(examples):.1%}), '
+            f'p50 {p50:.1f} ms, p95 {p95:.1f} ms, mean {sum(latencies) / len(latencies):.1f} ms'
+        ))
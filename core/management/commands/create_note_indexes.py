@@ -1,11 +1,11 @@
 from django.core.management.base import BaseCommand
 from django.db.models import Count
-from core.models import Video
+from core.models import Video, Note
 from engine.rag.index_notes import update_video_notes_index
 import time
 
 class Command(BaseCommand):
-    help = 'Creates or updates FAISS indexes for all videos that have notes.'
+    help = 'Creates or updates stored note embeddings for all videos that have notes.'
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Starting to index notes for all videos...'))
@@ -27,7 +27,9 @@ class Command(BaseCommand):
         for video in videos_with_notes:
             try:
                 self.stdout.write(f'Indexing notes for video: {video.title} (ID: {video.id})...')
-                update_video_notes_index(video.id)
+                users = {note.user for note in Note.objects.filter(video=video).select_related('user')}
+                for user in users:
+                    update_video_notes_index(video, user)
                 indexed_count += 1
             except Exception as e:
                 self.stderr.write(self.style.ERROR(f'Failed to index notes for video {video.id}: {e}'))
@@ -5,6 +5,7 @@ from django.core.management.base import BaseCommand
 from django.conf import settings
 from django.db import transaction
 from core.models import Video, OCRTranscript 
+from engine.rag.timeline import invalidate_video_timeline
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +35,8 @@ class Command(BaseCommand):
                     ocr_transcript_status='pending',
                     ocr_index_status='none' 
                 )
+            for video_pk in Video.objects.values_list('pk', flat=True):
+                invalidate_video_timeline(video_pk)
             self.stdout.write(self.style.SUCCESS(f'  - Deleted {count} OCR transcript rows from DB.'))
             self.stdout.write(self.style.SUCCESS('  - Reset video statuses.'))
         # ------------------
@@ -149,6 +152,7 @@ class Command(BaseCommand):
                 video.ocr_index_status = 'pending'
                 
                 video.save(update_fields=['ocr_transcript_status', 'ocr_index_status'])
+            invalidate_video_timeline(video.pk)
                 
             self.stdout.write(f"  [Imported] {video.title} ({len(transcript_objects)} segments)")
 
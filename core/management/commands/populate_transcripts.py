@@ -5,6 +5,7 @@ from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.db import connection, transaction
 from core.models import Video, Transcript
+from engine.rag.timeline import invalidate_video_timeline
 
 def sanitize_filename(title):
     return re.sub(r'[\\/*?:"<>|]', "", title)
@@ -31,6 +32,8 @@ class Command(BaseCommand):
         if wipe_data:
             self.stdout.write(self.style.WARNING('Wiping all existing transcripts from the database...'))
             deleted_count, _ = Transcript.objects.all().delete()
+            for video_pk in Video.objects.values_list('pk', flat=True):
+                invalidate_video_timeline(video_pk)
             self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted_count} old transcript lines.'))
             
             try:
@@ -121,6 +124,7 @@ class Command(BaseCommand):
                         
                         video.transcript_status = 'complete'
                         video.save()
+                    invalidate_video_timeline(video.pk)
                         
                     self.stdout.write(self.style.SUCCESS(f'  -> Successfully populated {len(lines_to_create)} lines and set video status to "complete".'))
                 else:
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 02:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_video_ocr_index_status_video_ocr_transcript_status_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='note',
+            name='embedding_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64),
+        ),
+    ]
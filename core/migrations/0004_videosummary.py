@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 09:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_note_embedding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transcript_version', models.CharField(max_length=64)),
+                ('summary', models.TextField()),
+                ('sections', models.JSONField(default=list)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='core.video')),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_videosummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VideoChapter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.FloatField()),
+                ('end', models.FloatField()),
+                ('title', models.CharField(max_length=200)),
+                ('description', models.TextField()),
+                ('transcript_version', models.CharField(max_length=64)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chapters', to='core.video')),
+            ],
+            options={
+                'ordering': ['start'],
+                'indexes': [models.Index(fields=['video', 'start'], name='core_videoc_video_i_1194d2_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-17 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_videochapter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='history_summary',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='conversation',
+            name='summarized_messages',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_conversation_history_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='llm_backend',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -89,6 +89,40 @@ class OCRTranscript(models.Model):
     def __str__(self):
         return f'OCR - {self.video.title} - {self.start}s'
 
+class VideoSummary(models.Model):
+    """
+    Hierarchical (map-reduce) summary of a video's transcript, generated once
+    at index time. `transcript_version` ties it to the transcript rows it was
+    built from; `sections` holds the per-chunk summaries with their time ranges.
+    """
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name='summary')
+    transcript_version = models.CharField(max_length=64)
+    summary = models.TextField()
+    sections = models.JSONField(default=list)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Summary - {self.video.title}'
+
+class VideoChapter(models.Model):
+    """
+    Topical chapter of a video, found at index time from drops in embedding
+    similarity between adjacent transcript windows.
+    """
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='chapters')
+    start = models.FloatField()
+    end = models.FloatField()
+    title = models.CharField(max_length=200)
+    description = models.TextField()
+    transcript_version = models.CharField(max_length=64)
+
+    class Meta:
+        ordering = ['start']
+        indexes = [models.Index(fields=['video', 'start'])]
+
+    def __str__(self):
+        return f'{self.video.title} - {self.title} ({self.start}s)'
+
 class Enrollment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     course = models.ForeignKey(Course, on_delete=models.CASCADE)
@@ -119,6 +153,11 @@ class Note(models.Model):
 
     index_status = models.CharField(max_length=20, choices= INDEX_STATUS_CHOICES, default='pending')
 
+    # float32 note embedding and a hash of (embedding model, embedded text),
+    # so only notes whose text actually changed are re-embedded
+    embedding = models.BinaryField(null=True, blank=True, editable=False)
+    embedding_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+
     class Meta:
         ordering = ['-created_at']
 
@@ -132,6 +171,13 @@ class Conversation(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='conversations')
     title = models.CharField(max_length=255, default="New Conversation")
     created_at = models.DateTimeField(auto_now_add=True)
+    # Rolling summary of older turns. The oldest `summarized_messages`
+    # messages are folded into it and are no longer sent to the LLM verbatim.
+    history_summary = models.TextField(blank=True, default="")
+    summarized_messages = models.PositiveIntegerField(default=0)
+    # Ollama node that answered the last turn; follow-ups are sent there so
+    # the prompt prefix already in its KV cache is not prefilled again
+    llm_backend = models.CharField(max_length=255, blank=True, default="")
 
     class Meta:
         ordering = ['-created_at']
@@ -3,6 +3,7 @@ from django.dispatch import receiver
 from django.db import transaction 
 from core.models import Note, Video
 from django_q.tasks import async_task
+from engine.rag.note_index_queue import queue_note_index_update
 import logging
 
 logger = logging.getLogger(__name__)
@@ -71,8 +72,7 @@ def on_note_save(sender, instance, created, **kwargs):
             
             logger.info(f"Signal: Queuing note index update for user {instance.user.id}, video {platform_id}")
             
-            transaction.on_commit(lambda: async_task(
-                'engine.tasks.task_update_note_index', 
+            transaction.on_commit(lambda: queue_note_index_update(
                 user_id=instance.user.id, 
                 video_id=platform_id
             ))
@@ -87,8 +87,7 @@ def on_note_delete(sender, instance, **kwargs):
         if platform_id:
             logger.info(f"Signal: Queuing note index update (due to delete) for user {instance.user.id}, video {platform_id}")
             
-            transaction.on_commit(lambda: async_task(
-                'engine.tasks.task_update_note_index', 
+            transaction.on_commit(lambda: queue_note_index_update(
                 user_id=instance.user.id, 
                 video_id=platform_id
             ))
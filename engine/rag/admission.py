@@ -0,0 +1,192 @@
+import math
+import asyncio
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, asynccontextmanager
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """The LLM is saturated; the client should retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int, reason: str = "queue full"):
+        super().__init__(f"LLM admission rejected ({reason}); retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class _Waiter:
+    """A queued caller: a thread waiting on `event`, or a coroutine on `future`."""
+
+    def __init__(self, loop=None):
+        self.event = threading.Event()
+        self.loop = loop
+        self.future = loop.create_future() if loop else None
+        self.admitted = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class AdmissionController:
+    """
+    Limits concurrent LLM generations in this worker to `max_concurrent`.
+    Callers beyond that wait in per-client queues that are served round-robin,
+    so one client firing many requests cannot starve the others. When
+    `max_queue` callers are already waiting, new ones are rejected at once,
+    and a caller that waits longer than `max_wait` seconds is rejected too.
+    Both rejections carry a Retry-After estimate.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, max_wait: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queued = 0
+        self._queues: OrderedDict = OrderedDict()  # client -> deque of _Waiter, in round-robin order
+        self._waits_ms = deque(maxlen=500)
+        self._service_seconds = 10.0  # moving average, seeded with a typical answer time
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @contextmanager
+    def slot(self, client: str):
+        """Holds one generation slot for the duration of the block."""
+        self._acquire(client)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    @asynccontextmanager
+    async def aslot(self, client: str):
+        """`slot` for coroutines: waiting in the queue does not block the event loop."""
+        requested = time.monotonic()
+        waiter = self._admit_or_enqueue(client, asyncio.get_running_loop())
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                pass
+            except asyncio.CancelledError:
+                self._abandon(client, waiter)
+                raise
+            self._finish_wait(client, waiter, requested)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def _admit_or_enqueue(self, client: str, loop=None) -> _Waiter | None:
+        """Takes a free slot (returns None) or queues a waiter for one."""
+        with self._lock:
+            if self._active < self.max_concurrent and self._queued == 0:
+                self._active += 1
+                self.admitted += 1
+                self._waits_ms.append(0.0)
+                return None
+            if self._queued >= self.max_queue:
+                self.rejected += 1
+                raise AdmissionRejected(self._retry_after_locked())
+            waiter = _Waiter(loop)
+            self._queues.setdefault(client, deque()).append(waiter)
+            self._queued += 1
+            logger.info(f"LLM busy ({self._active} active); {client} queued at depth {self._queued}.")
+            return waiter
+
+    def _acquire(self, client: str):
+        requested = time.monotonic()
+        waiter = self._admit_or_enqueue(client)
+        if waiter is not None:
+            waiter.event.wait(self.max_wait)
+            self._finish_wait(client, waiter, requested)
+
+    def _finish_wait(self, client: str, waiter: _Waiter, requested: float):
+        with self._lock:
+            if not waiter.admitted:
+                queue = self._queues.get(client)
+                if queue is not None:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[client]
+                self._queued -= 1
+                self.timed_out += 1
+                raise AdmissionRejected(self._retry_after_locked(), reason="wait timed out")
+            self._waits_ms.append((time.monotonic() - requested) * 1000)
+
+    def _abandon(self, client: str, waiter: _Waiter):
+        """A waiting coroutine was cancelled: leave the queue, or hand back the slot it was just given."""
+        with self._lock:
+            admitted = waiter.admitted
+            if not admitted:
+                queue = self._queues.get(client)
+                if queue is not None:
+                    queue.remove(waiter)
+                    if not queue:
+                        del self._queues[client]
+                self._queued -= 1
+        if admitted:
+            self._release(None)
+
+    def _release(self, service_seconds: float | None):
+        with self._lock:
+            if service_seconds is not None:
+                self._service_seconds = 0.8 * self._service_seconds + 0.2 * service_seconds
+            self._active -= 1
+            while self._active < self.max_concurrent and self._queued:
+                client, queue = next(iter(self._queues.items()))
+                waiter = queue.popleft()
+                self._queued -= 1
+                if queue:
+                    self._queues.move_to_end(client)
+                else:
+                    del self._queues[client]
+                waiter.admitted = True
+                self._active += 1
+                self.admitted += 1
+                waiter.wake()
+
+    def _retry_after_locked(self) -> int:
+        # Time for the current queue to drain through the available slots
+        return max(1, math.ceil(self._service_seconds * (self._queued + 1) / self.max_concurrent))
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits_ms)
+            return {
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'active': self._active,
+                'queued': self._queued,
+                'queued_clients': len(self._queues),
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'wait_ms_p50': waits[len(waits) // 2] if waits else 0.0,
+                'wait_ms_p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+                'service_ms_avg': self._service_seconds * 1000,
+                'retry_after': self._retry_after_locked(),
+            }
+
+
+admission_controller = AdmissionController(
+    max_concurrent=settings.LLM_MAX_CONCURRENCY,
+    max_queue=settings.LLM_MAX_QUEUE,
+    max_wait=settings.LLM_MAX_QUEUE_WAIT_SECONDS
+)
@@ -0,0 +1,165 @@
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+from core.models import Video
+from .vector_store.config import embed_query_cached
+from .versions import current_generation
+
+logger = logging.getLogger(__name__)
+
+# Routes whose answers may be reused. 'time' depends on the player position
+# and 'notes' is a cheap database read that must always be current.
+CACHEABLE_ROUTES = ('rag', 'general', 'summary')
+
+# Routes that never look at chat history or the user's notes
+SHARED_ROUTES = ('general', 'summary')
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s:]", " ", query.lower())).strip()
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    vector: np.ndarray
+    route: str
+    user_id: int | None
+    generation: tuple
+    answer: str
+    expires_at: float
+
+
+class AnswerCache:
+    """
+    In-process cache of generated answers, grouped per video. A question hits
+    when an entry for the same video has the same normalized text, or an
+    embedding with cosine similarity >= ANSWER_CACHE_MIN_SIMILARITY, and:
+    - the video's generation (and for 'rag', the user's note generation) is
+      unchanged since the answer was generated,
+    - for 'rag', the entry belongs to the same user (None for the public
+      assistant) and both questions came without chat history.
+    Entries expire after ANSWER_CACHE_TTL_SECONDS; past ANSWER_CACHE_MAX_ENTRIES
+    the least recently used video's entries go first.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._videos: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generations(self, video_pk, user_id: int | None) -> tuple:
+        """Take this before generating an answer and pass it to `store`."""
+        return current_generation(video_pk), current_generation(video_pk, user_id) if user_id is not None else None
+
+    def lookup(self, video_pk, query: str, user_id: int | None, has_history: bool) -> CachedAnswer | None:
+        normalized = normalize_query(query)
+        generation, note_generation = self.generations(video_pk, user_id)
+        now = time.time()
+
+        with self._lock:
+            entries = self._videos.get(video_pk, [])
+            live = [e for e in entries if e.expires_at > now and e.generation[0] == generation]
+            if len(live) != len(entries):
+                self._size -= len(entries) - len(live)
+                self._videos[video_pk] = live
+
+        candidates = [
+            e for e in live
+            if e.route in SHARED_ROUTES
+            or (not has_history and e.user_id == user_id and e.generation[1] == note_generation)
+        ]
+        if not candidates:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        match = next((e for e in candidates if e.query == normalized), None)
+        if match is None:
+            vector = self._unit_vector(query)
+            similarities = np.vstack([e.vector for e in candidates]) @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= settings.ANSWER_CACHE_MIN_SIMILARITY:
+                match = candidates[best]
+                logger.info(f"Answer cache: '{query}' matched '{match.query}' (similarity {similarities[best]:.3f}).")
+
+        with self._lock:
+            if match is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                if video_pk in self._videos:
+                    self._videos.move_to_end(video_pk)
+        return match
+
+    def store(self, video_pk, query: str, route: str, answer: str, user_id: int | None, has_history: bool, generations: tuple):
+        if route not in CACHEABLE_ROUTES or not answer:
+            return
+        if route not in SHARED_ROUTES and has_history:
+            return  # shaped by the conversation so far
+
+        normalized = normalize_query(query)
+        scope = None if route in SHARED_ROUTES else user_id
+        entry = CachedAnswer(
+            query=normalized,
+            vector=self._unit_vector(query),
+            route=route,
+            user_id=scope,
+            generation=(generations[0], None) if scope is None else generations,
+            answer=answer,
+            expires_at=time.time() + self.ttl_seconds
+        )
+        with self._lock:
+            entries = self._videos.setdefault(video_pk, [])
+            before = len(entries)
+            entries[:] = [e for e in entries if not (e.query == normalized and e.user_id == scope)]
+            entries.append(entry)
+            self._size += len(entries) - before
+            self._videos.move_to_end(video_pk)
+            while self._size > self.max_entries and self._videos:
+                _, evicted = self._videos.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._videos.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'videos': len(self._videos), 'entries': self._size, 'hits': self.hits, 'misses': self.misses}
+
+    @staticmethod
+    def _unit_vector(text: str) -> np.ndarray:
+        # The raw question, the same text the classifier and retriever embed,
+        # so all three share one memoised embedding call.
+        vector = np.asarray(embed_query_cached(text), dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS
+)
+
+_video_pks: dict = {}
+
+
+def get_video_pk(video_id: str) -> int | None:
+    """Database id for a YouTube/Vimeo id; the mapping never changes, so it is memoized."""
+    pk = _video_pks.get(video_id)
+    if pk is None:
+        pk = Video.objects.filter(Q(youtube_id=video_id) | Q(vimeo_id=video_id)).values_list('pk', flat=True).first()
+        if pk is not None:
+            _video_pks[video_id] = pk
+    return pk
@@ -1,15 +1,68 @@
+from functools import lru_cache
 from django.conf import settings
-from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
 from operator import itemgetter 
 from .vector_store.retriever import get_retriever
+from .context_packing import pack_context
+from .ollama_pool import chat_pool, PooledChatOllama
+from .llm_budget import BudgetedLLM
 
 # Use the model defined in settings (DeepSeek-R1-Distill 14B)
 LLM_MODEL = settings.OLLAMA_MODEL
-BASE_URL = settings.OLLAMA_BASE_URL
 
+
+def get_llm(temperature: float, model: str = LLM_MODEL, num_predict: int | None = None, num_ctx: int | None = None) -> PooledChatOllama:
+    """
+    Shared ChatOllama clients per (model, temperature, limits), one per node of
+    the Ollama pool; each call goes to the least-loaded healthy node. Reusing
+    the clients keeps their HTTP connection pools alive between requests, and
+    `keep_alive` asks Ollama to keep the model resident between bursts.
+    """
+    return _build_llm(model, float(temperature), num_predict, num_ctx)
+
+
+@lru_cache(maxsize=None)
+def _build_llm(model: str, temperature: float, num_predict: int | None, num_ctx: int | None) -> PooledChatOllama:
+    return PooledChatOllama(
+        chat_pool,
+        model=model,
+        temperature=temperature,
+        num_predict=num_predict,
+        num_ctx=num_ctx,
+        keep_alive=settings.OLLAMA_KEEP_ALIVE
+    )
+
+
+def get_route_llm(route: str, temperature: float):
+    """
+    LLM for one of the LLM_ROUTES: its model, num_predict / num_ctx caps and
+    wall-clock budget, falling back to LLM_FALLBACK_MODEL (with the same caps)
+    when the budget runs out.
+    """
+    config = settings.LLM_ROUTES[route]
+    primary = get_llm(temperature, config['model'], config.get('num_predict'), config.get('num_ctx'))
+    fallback = None
+    if settings.LLM_FALLBACK_MODEL != config['model']:
+        fallback = get_llm(temperature, settings.LLM_FALLBACK_MODEL, config.get('num_predict'), config.get('num_ctx'))
+    return BudgetedLLM(primary, fallback, config.get('budget_seconds'), route)
+
+
+CLASSIFIER_PROMPT = ChatPromptTemplate.from_template(
+    "Classify the user's question into one of three categories: 'Fetch_Notes', 'RAG', or 'General'.\n"
+    "1.  'Fetch_Notes' questions are requests to list, see, or get all personal notes. "
+    "    Examples: 'show me all my notes', 'what notes do I have?', 'list my notes for this video'.\n"
+    "2.  'RAG' questions ask something specific about the video content, the user's notes, or the transcript. "
+    "    Examples: 'what did the video say about variables?', 'explain my note on functions', 'what is a decorator?'.\n"
+    "3.  'General' questions are for information not in the video or notes. "
+    "    Examples: 'hello', 'who are you?', 'what is the capital of France?'.\n\n"
+    "Respond with ONLY the category name ('Fetch_Notes', 'RAG', or 'General') and nothing else. Do not include reasoning or XML tags.\n\n"
+    "Question: {question}\nCategory:"
+)
+
+
+@lru_cache(maxsize=None)
 def get_query_type_classifier_chain():
     """
     Classifies the user's question into one of three categories:
@@ -17,86 +70,41 @@ def get_query_type_classifier_chain():
     2.  RAG: A specific question about the video content that requires context.
     3.  General: A general knowledge question not related to the video.
     """
-    prompt = ChatPromptTemplate.from_template(
-        "Classify the user's question into one of three categories: 'Fetch_Notes', 'RAG', or 'General'.\n"
-        "1.  'Fetch_Notes' questions are requests to list, see, or get all personal notes. "
-        "    Examples: 'show me all my notes', 'what notes do I have?', 'list my notes for this video'.\n"
-        "2.  'RAG' questions ask something specific about the video content, the user's notes, or the transcript. "
-        "    Examples: 'what did the video say about variables?', 'explain my note on functions', 'what is a decorator?'.\n"
-        "3.  'General' questions are for information not in the video or notes. "
-        "    Examples: 'hello', 'who are you?', 'what is the capital of France?'.\n\n"
-        "Respond with ONLY the category name ('Fetch_Notes', 'RAG', or 'General') and nothing else. Do not include reasoning or XML tags.\n\n"
-        "Question: {question}\nCategory:"
-    )
-    
-    llm = ChatOllama(
-        model=LLM_MODEL,
-        base_url=BASE_URL,
-        temperature=0
-    )
-    return prompt | llm | StrOutputParser()
+    return CLASSIFIER_PROMPT | get_route_llm('classifier', temperature=0) | StrOutputParser()
 
 
-def get_rag_chain(video_id: str, user_id: int | None):
-    retriever = get_retriever(video_id, user_id=user_id)
-
-    prompt_template = """
+# Ordered for Ollama's prompt cache: the fixed instructions, then the chat
+# history (which only grows between turns), then what changes every turn.
+# A follow-up shares its prefix with the previous prompt and skips its prefill.
+RAG_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """
     You are a helpful AI assistant for the InCuiseNix e-learning platform.
     Your goal is to provide accurate and helpful answers based on the user's question and the context provided.
 
     Use the following sources to answer the user's question:
-    1.  **Video Context**: Key information retrieved from:
+    1.  **Chat History**: The ongoing conversation between you and the user.
+    2.  **Video Context**: Key information retrieved from:
         * **Audio Transcripts**: What was spoken by the instructor.
         * **Visual Text (OCR)**: Code, slides, diagrams, or text shown on screen that may not have been spoken.
         * **User Notes**: Personal annotations made by the user.
-    2.  **Chat History**: The ongoing conversation between you and the user.
+    """),
+    ("human", """
+    CHAT HISTORY:
+    {chat_history}
 
     CONTEXT:
     {context}
 
-    CHAT HISTORY:
-    {chat_history}
-
     QUESTION:
     {question}
-    """
-    
-    prompt = ChatPromptTemplate.from_template(prompt_template)
-    
-    llm = ChatOllama(
-        model=LLM_MODEL,
-        base_url=BASE_URL,
-        temperature=0.3  # Slightly creative but focused for RAG
-    )
-
-    rag_chain = (
-        {
-            "context": itemgetter("question") | retriever,
-            "question": itemgetter("question"),
-            "chat_history": itemgetter("chat_history"),
-        }
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
-
-    return rag_chain
+    """),
+])
 
+GENERAL_PROMPT = ChatPromptTemplate.from_template(
+    "You are a helpful AI assistant. Answer the following question to the best of your ability.\nQuestion: {question}"
+)
 
-def get_general_chain():
-    prompt = ChatPromptTemplate.from_template(
-        "You are a helpful AI assistant. Answer the following question to the best of your ability.\nQuestion: {question}"
-    )
-    llm = ChatOllama(
-        model=LLM_MODEL,
-        base_url=BASE_URL,
-        temperature=0.7
-    )
-    return prompt | llm | StrOutputParser()
-
-
-def get_summarizer_chain():
-    prompt_template = """
+SUMMARIZER_PROMPT = ChatPromptTemplate.from_template("""
     You are an expert AI assistant for the InCuiseNix e-learning platform.
     Your task is to provide a concise and helpful summary of the video content provided below.
     
@@ -107,17 +115,9 @@ def get_summarizer_chain():
 
     REQUEST:
     {question}
-    """
-    prompt = ChatPromptTemplate.from_template(prompt_template)
-    llm = ChatOllama(
-        model=LLM_MODEL,
-        base_url=BASE_URL,
-        temperature=0.2
-    )
-    return prompt | llm | StrOutputParser()
+    """)
 
-def get_time_based_chain():
-    prompt_template = """
+TIME_BASED_PROMPT = ChatPromptTemplate.from_template("""
     You are an expert AI assistant for a video learning platform.
     The user has asked what is being discussed at a specific moment in the video.
     
@@ -129,11 +129,111 @@ def get_time_based_chain():
     {context}
 
     Based *only* on the context provided above, what is being discussed?
+    """)
+
+SECTION_SUMMARY_PROMPT = ChatPromptTemplate.from_template("""
+    You are summarizing one section ({start} to {end}) of a lecture video on the InCuiseNix e-learning platform.
+    Write 3-5 concise bullet points covering the concepts, code and examples in this section.
+    Use only the transcript below.
+
+    TRANSCRIPT:
+    {context}
+    """)
+
+COMBINE_SUMMARY_PROMPT = ChatPromptTemplate.from_template("""
+    You are combining section summaries of a lecture video into a single summary.
+    Write a short overview paragraph followed by the key points, in the order they are taught.
+    Use only the section summaries below.
+
+    SECTION SUMMARIES:
+    {context}
+    """)
+
+CHAPTER_PROMPT = ChatPromptTemplate.from_template("""
+    The following is the transcript of one chapter ({start} to {end}) of a lecture video.
+    Give the chapter a short title (at most 8 words) and describe what is taught in it in 1-2 sentences.
+    Respond in exactly this format and nothing else:
+    TITLE: <title>
+    DESCRIPTION: <description>
+
+    TRANSCRIPT:
+    {context}
+    """)
+
+CONVERSATION_SUMMARY_PROMPT = ChatPromptTemplate.from_template("""
+    You maintain a running summary of a conversation between a student and a video learning assistant.
+    Update the summary with the new turns below. Keep the topics asked about, the facts and answers given,
+    and anything the student said about themselves or their goals. Drop greetings and repetition.
+    Keep it under {max_words} words. Respond with only the updated summary.
+
+    CURRENT SUMMARY:
+    {summary}
+
+    NEW TURNS:
+    {turns}
+    """)
+
+
+def get_rag_chain(video_id: str, user_id: int | None, documents: list | None = None):
     """
-    prompt = ChatPromptTemplate.from_template(prompt_template)
-    llm = ChatOllama(
-        model=LLM_MODEL,
-        base_url=BASE_URL,
-        temperature=0.2
+    RAG chain for a video. If `documents` were already retrieved (e.g. by
+    speculative retrieval) they are used as the context instead of searching again.
+    Either way the documents are packed (deduped, trimmed to the token budget,
+    put in video order) before they reach the prompt.
+    """
+    if documents is not None:
+        context = RunnableLambda(lambda _: pack_context(documents))
+    else:
+        context = itemgetter("question") | get_retriever(video_id, user_id=user_id) | RunnableLambda(pack_context)
+
+    rag_chain = (
+        {
+            "context": context,
+            "question": itemgetter("question"),
+            "chat_history": itemgetter("chat_history"),
+        }
+        | RAG_PROMPT
+        | get_route_llm('rag', temperature=0.3)  # Slightly creative but focused for RAG
+        | StrOutputParser()
     )
-    return prompt | llm | StrOutputParser()
\ No newline at end of file
+
+    return rag_chain
+
+
+@lru_cache(maxsize=None)
+def get_general_chain():
+    return GENERAL_PROMPT | get_route_llm('general', temperature=0.7) | StrOutputParser()
+
+
+@lru_cache(maxsize=None)
+def get_summarizer_chain():
+    return SUMMARIZER_PROMPT | get_route_llm('summary', temperature=0.2) | StrOutputParser()
+
+
+@lru_cache(maxsize=None)
+def get_time_based_chain():
+    return TIME_BASED_PROMPT | get_route_llm('time', temperature=0.2) | StrOutputParser()
+
+
+@lru_cache(maxsize=None)
+def get_section_summary_chain():
+    """Map step of the hierarchical summarizer: one transcript time chunk -> bullet points."""
+    return SECTION_SUMMARY_PROMPT | get_route_llm('background', temperature=0.2) | StrOutputParser()
+
+
+@lru_cache(maxsize=None)
+def get_combine_summary_chain():
+    """Reduce step of the hierarchical summarizer: several summaries -> one."""
+    return COMBINE_SUMMARY_PROMPT | get_route_llm('background', temperature=0.2) | StrOutputParser()
+
+
+@lru_cache(maxsize=None)
+def get_chapter_chain():
+    """Titles and describes one chapter found by the chapter segmenter."""
+    return CHAPTER_PROMPT | get_route_llm('background', temperature=0.2) | StrOutputParser()
+
+
+@lru_cache(maxsize=None)
+def get_conversation_summary_chain():
+    """Folds older chat turns into a conversation's rolling summary."""
+    return CONVERSATION_SUMMARY_PROMPT | get_route_llm('background', temperature=0) | StrOutputParser()
@@ -0,0 +1,117 @@
+import re
+import logging
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from core.models import Transcript, Video, VideoChapter
+from .chains import get_chapter_chain
+from .text import format_seconds
+from .vector_store.chunking import merge_into_time_windows
+from .vector_store.config import get_indexing_embeddings
+from .timeline import invalidate_video_timeline
+from .versions import transcript_version
+
+logger = logging.getLogger(__name__)
+
+# "what is happening at 34:17", "what's being discussed around 5:00?", ...
+PLAIN_TIME_REQUEST = re.compile(
+    r"^what('s| is| was)( the (instructor|teacher|video))?"
+    r"( (happening|going on|being (discussed|explained|shown|taught)|(he|she|they|it) (is )?(talking about|explaining|discussing)|talking about|discussed|explained))"
+    r"( in the video)?( at| around| near)( the)? [\d:]+( (minutes?|mins?))?( in the video)?$",
+    re.IGNORECASE
+)
+
+
+def is_plain_time_request(query: str) -> bool:
+    return bool(PLAIN_TIME_REQUEST.match(query.strip().rstrip('?.!').strip()))
+
+
+def find_chapter_boundaries(windows: list[dict], vectors: np.ndarray) -> list[int]:
+    """
+    Returns indexes of windows that start a new chapter (always including 0).
+
+    A boundary is placed before window i+1 when the cosine similarity of
+    windows i and i+1 is a local minimum more than CHAPTER_BOUNDARY_STD
+    standard deviations below the mean, keeping every chapter at least
+    CHAPTER_MIN_SECONDS long. Deeper dips are considered first.
+    """
+    if len(windows) < 2:
+        return [0]
+
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    similarities = np.sum(unit[:-1] * unit[1:], axis=1)
+    threshold = similarities.mean() - settings.CHAPTER_BOUNDARY_STD * similarities.std()
+
+    candidates = [
+        i + 1 for i in range(len(similarities))
+        if similarities[i] < threshold
+        and (i == 0 or similarities[i] <= similarities[i - 1])
+        and (i == len(similarities) - 1 or similarities[i] <= similarities[i + 1])
+    ]
+
+    min_seconds = settings.CHAPTER_MIN_SECONDS
+    video_start, video_end = windows[0]['start'], windows[-1]['end']
+    boundaries = [0]
+    for b in sorted(candidates, key=lambda b: similarities[b - 1]):
+        start = windows[b]['start']
+        if start - video_start < min_seconds or video_end - start < min_seconds:
+            continue
+        if all(abs(start - windows[other]['start']) >= min_seconds for other in boundaries):
+            boundaries.append(b)
+    return sorted(boundaries)
+
+
+def _parse_title_and_description(text: str, fallback_title: str) -> tuple[str, str]:
+    title_match = re.search(r"TITLE:\s*(.+)", text)
+    description_match = re.search(r"DESCRIPTION:\s*(.+)", text, re.DOTALL)
+    title = title_match.group(1).strip() if title_match else fallback_title
+    description = description_match.group(1).strip() if description_match else text.strip()
+    return title[:200], description
+
+
+def build_video_chapters(video: Video) -> list[VideoChapter]:
+    """Segments a video's transcript into titled chapters and stores them."""
+    version = transcript_version(video)
+    rows = Transcript.objects.filter(video=video).order_by('start').values_list('start', 'content')
+    windows = merge_into_time_windows(rows, window_seconds=settings.CHAPTER_WINDOW_SECONDS, end_of_video=video.duration)
+    if not windows:
+        logger.warning(f"No transcript to segment into chapters for video {video.id}.")
+        return []
+
+    vectors = np.asarray(get_indexing_embeddings().embed_documents([w['content'] for w in windows]), dtype=np.float32)
+    boundaries = find_chapter_boundaries(windows, vectors)
+    logger.info(f"Found {len(boundaries)} chapters in {len(windows)} windows for video {video.id}.")
+
+    spans = []
+    for n, first in enumerate(boundaries):
+        last = (boundaries[n + 1] if n + 1 < len(boundaries) else len(windows)) - 1
+        spans.append({
+            'start': windows[first]['start'],
+            'end': windows[last]['end'],
+            'content': " ".join(w['content'] for w in windows[first:last + 1]),
+        })
+
+    outputs = get_chapter_chain().batch([
+        {"start": format_seconds(s['start']), "end": format_seconds(s['end']), "context": s['content']}
+        for s in spans
+    ], config={"max_concurrency": settings.SUMMARY_MAX_CONCURRENCY})
+
+    chapters = []
+    for n, (span, output) in enumerate(zip(spans, outputs), start=1):
+        title, description = _parse_title_and_description(output, f"Chapter {n}")
+        chapters.append(VideoChapter(
+            video=video,
+            start=span['start'],
+            end=span['end'],
+            title=title,
+            description=description,
+            transcript_version=version
+        ))
+
+    with transaction.atomic():
+        VideoChapter.objects.filter(video=video).delete()
+        VideoChapter.objects.bulk_create(chapters)
+    invalidate_video_timeline(video.pk)
+    logger.info(f"Stored {len(chapters)} chapters for video {video.id} (transcript version {version}).")
+    return chapters
+
@@ -0,0 +1,109 @@
+import re
+import logging
+from collections import defaultdict
+from django.conf import settings
+from langchain_core.documents import Document
+from .text import estimate_tokens, format_seconds
+
+logger = logging.getLogger(__name__)
+
+SOURCE_LABELS = {'transcript': 'Transcript', 'ocr': 'On screen', 'note': 'Your note'}
+
+_WORD = re.compile(r"\w+")
+
+
+def adaptive_cut(docs: list[Document]) -> list[Document]:
+    """
+    Drops the tail of one source's results after the first large jump in
+    distance (metadata 'score', lower is closer): once consecutive scores
+    differ by more than RAG_SCORE_GAP, the remaining hits are about
+    something else. Documents without a score are kept as they are.
+    """
+    if len(docs) < 2 or any('score' not in d.metadata for d in docs):
+        return docs
+    docs = sorted(docs, key=lambda d: d.metadata['score'])
+    for i in range(1, len(docs)):
+        if docs[i].metadata['score'] - docs[i - 1].metadata['score'] > settings.RAG_SCORE_GAP:
+            return docs[:i]
+    return docs
+
+
+def _words(text: str) -> set[str]:
+    return set(_WORD.findall(text.lower()))
+
+
+def is_near_duplicate(words: set[str], kept: list[set[str]]) -> bool:
+    """True if `words` mostly repeats an already kept chunk (Jaccard or containment)."""
+    for other in kept:
+        if not words or not other:
+            continue
+        overlap = len(words & other)
+        if overlap / len(words | other) >= settings.RAG_DEDUPE_JACCARD:
+            return True
+        if overlap / min(len(words), len(other)) >= settings.RAG_DEDUPE_CONTAINMENT:
+            return True
+    return False
+
+
+def start_time(doc: Document) -> float:
+    """Position of the document in the video, in seconds (0 when unknown)."""
+    return doc.metadata.get('start_time', doc.metadata.get('timestamp')) or 0.0
+
+
+def format_context_document(doc: Document) -> str:
+    label = SOURCE_LABELS.get(doc.metadata.get('type'), 'Context')
+    if doc.metadata.get('start_time') is not None or doc.metadata.get('timestamp') is not None:
+        label = f"{format_seconds(start_time(doc))} {label}"
+    return f"[{label}] {doc.page_content}"
+
+
+def rank_context_documents(docs: list[Document], token_budget: int | None = None, limit: int | None = None) -> list[Document]:
+    """
+    The best of ranked (fused) documents, still in rank order: adaptive k
+    per source, then near-duplicate removal, the token budget (None: no
+    budget) and at most `limit` documents, all in rank order so the best
+    chunks win.
+    """
+    by_source = defaultdict(list)
+    for doc in docs:
+        by_source[doc.metadata.get('type')].append(doc)
+    allowed = {id(d) for source_docs in by_source.values() for d in adaptive_cut(source_docs)}
+
+    selected = []
+    kept_words = []
+    budget = token_budget
+    for doc in docs:
+        if id(doc) not in allowed:
+            continue
+        words = _words(doc.page_content)
+        if is_near_duplicate(words, kept_words):
+            continue
+        if budget is not None:
+            cost = estimate_tokens(format_context_document(doc))
+            if cost > budget:
+                continue
+            budget -= cost
+        selected.append(doc)
+        kept_words.append(words)
+        if len(selected) == limit:
+            break
+    return selected
+
+
+def select_context_documents(docs: list[Document], token_budget: int | None = None) -> list[Document]:
+    """
+    Picks what goes into the prompt from ranked (fused) documents with
+    rank_context_documents, within RAG_CONTEXT_TOKEN_BUDGET by default.
+    The result is in video order.
+    """
+    if token_budget is None:
+        token_budget = settings.RAG_CONTEXT_TOKEN_BUDGET
+    selected = rank_context_documents(docs, token_budget)
+    used = sum(estimate_tokens(format_context_document(d)) for d in selected)
+    logger.info(f"Context packing kept {len(selected)} of {len(docs)} chunks (~{used} tokens).")
+    return sorted(selected, key=start_time)
+
+
+def pack_context(docs: list[Document]) -> str:
+    """Selected documents rendered as timestamped, labelled lines for the RAG prompt."""
+    return "\n\n".join(format_context_document(d) for d in select_context_documents(docs))
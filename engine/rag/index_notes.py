@@ -1,74 +1,74 @@
 import os
 import shutil
-from langchain_community.vectorstores import FAISS
-from langchain_core.documents import Document
+import hashlib
+import numpy as np
 from django.conf import settings
 from django.contrib.auth.models import User
 from core.models import Note, Video
-from .vector_store.config import get_embeddings
+from .vector_store.config import get_indexing_embeddings
+from .versions import bump_generation
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+def note_embedding_text(note: Note) -> str:
+    return f"Title: {note.title}\nContent: {note.content}"
+
+
+def note_embedding_hash(text: str) -> str:
+    return hashlib.sha256(f"{settings.OLLAMA_EMBEDDING_MODEL}\0{text}".encode('utf-8')).hexdigest()
+
+
 def update_video_notes_index(video: Video, user: User):
     """
-    Creates or updates a user-specific FAISS index for their notes
-    on a specific video.
+    Brings the stored embeddings of a user's notes on a video up to date.
+    Only notes whose text (or the embedding model) changed since they were
+    last embedded are sent to the embedding model; deleted notes simply
+    disappear with their rows.
     """
     try:
-        notes = Note.objects.filter(video=video, user=user)
-
         # Get the actual platform ID (YouTube or Vimeo)
         platform_id = video.youtube_id or video.vimeo_id
         if not platform_id:
              logger.error(f"Video {video.pk} has no youtube_id or vimeo_id. Cannot create notes index.")
              return # Cannot proceed without a platform ID
 
-        # Construct the user-specific path using the platform_id
-        index_dir = os.path.join(
-            settings.FAISS_INDEX_ROOT,
-            'notes',
-            str(user.id),
-            platform_id 
-        )
-
-        if not notes.exists():
-            if os.path.exists(index_dir):
-                logger.info(f"No notes found for user {user.id}, video {platform_id}. Deleting old index at {index_dir}.")
-                shutil.rmtree(index_dir)
-            else:
-                 logger.info(f"No notes found for user {user.id}, video {platform_id}. No index to delete.")
-            return # Exit function if no notes
+        _remove_legacy_faiss_index(user.id, platform_id)
 
-        documents = []
-        for note in notes:
-            doc = Document(
-                page_content=f"Title: {note.title}\nContent: {note.content}",
-                metadata={
-                    "user_id": note.user.id,
-                    "note_id": note.id,
-                    "course_id": note.course.id,
-                    "video_db_id": video.id, # Keep DB ID for potential internal linking
-                    "video_platform_id": platform_id, # Add platform ID for consistency
-                    "timestamp": note.video_timestamp
-                }
-            )
-            documents.append(doc)
+        stale = []
+        for note in Note.objects.filter(video=video, user=user):
+            text = note_embedding_text(note)
+            text_hash = note_embedding_hash(text)
+            if note.embedding is None or note.embedding_hash != text_hash:
+                stale.append((note, text, text_hash))
 
-        # Double check in case notes existed but resulted in no documents somehow
-        if not documents:
-            if os.path.exists(index_dir):
-                 logger.warning(f"Note query returned results but no documents generated for user {user.id}, video {platform_id}. Deleting index.")
-                 shutil.rmtree(index_dir)
-            return
+        if stale:
+            vectors = get_indexing_embeddings().embed_documents([text for _, text, _ in stale])
+            for (note, _, text_hash), vector in zip(stale, vectors):
+                # update() rather than save() so the post_save signal doesn't re-queue this task
+                Note.objects.filter(pk=note.pk).update(
+                    embedding=np.asarray(vector, dtype=np.float32).tobytes(),
+                    embedding_hash=text_hash
+                )
+            logger.info(f"Embedded {len(stale)} changed notes for user {user.id}, video {platform_id}.")
+        else:
+            logger.info(f"Note embeddings already up to date for user {user.id}, video {platform_id}.")
 
-        os.makedirs(index_dir, exist_ok=True)
-        embeddings = get_embeddings()
-        vector_store = FAISS.from_documents(documents, embeddings)
-        vector_store.save_local(index_dir)
-        logger.info(f"Successfully updated notes index for user {user.id}, video {platform_id} at {index_dir}")
+        # Notes were added, edited or deleted: answers built on them are stale.
+        # Bumped only once the new embeddings are stored, so an answer built
+        # from the old vectors is never cached under the new generation.
+        bump_generation(video.pk, user.id)
 
     except Exception as e:
         # Try to get platform_id for better logging, fallback to video.id
         p_id = getattr(video, 'youtube_id', None) or getattr(video, 'vimeo_id', video.id)
-        logger.error(f"Error updating notes index for user {user.id}, video {p_id}: {e}", exc_info=True)
\ No newline at end of file
+        logger.error(f"Error updating notes index for user {user.id}, video {p_id}: {e}", exc_info=True)
+
+
+def _remove_legacy_faiss_index(user_id: int, platform_id: str):
+    """Notes used to be indexed into faiss_indexes/notes/<user>/<video>; clean those up."""
+    index_dir = os.path.join(settings.FAISS_INDEX_ROOT, 'notes', str(user_id), platform_id)
+    if os.path.exists(index_dir):
+        logger.info(f"Removing legacy FAISS notes index at {index_dir}.")
+        shutil.rmtree(index_dir, ignore_errors=True)
@@ -0,0 +1,40 @@
+import logging
+from django.conf import settings
+from langchain_core.documents import Document
+from .vector_store.retriever import get_retriever
+from .context_packing import SOURCE_LABELS, rank_context_documents, start_time
+from .text import format_seconds, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def _snippet(doc: Document) -> dict:
+    start = start_time(doc)
+    return {
+        'type': doc.metadata.get('type'),
+        'start': start,
+        'end': doc.metadata.get('end_time'),
+        'timestamp': format_seconds(start),
+        'text': truncate_to_tokens(doc.page_content, settings.INSTANT_SNIPPET_TOKENS),
+        'score': doc.metadata.get('score'),
+    }
+
+
+def instant_snippets(query: str, video_id: str, user_id: int | None) -> list[dict]:
+    """
+    The best transcript/OCR/note passages for the query straight from the
+    vector search, no LLM involved: fused rank order, adaptive k per source
+    and near-duplicates removed, at most INSTANT_SNIPPET_COUNT of them.
+    """
+    docs = get_retriever(video_id, user_id=user_id).invoke(query)
+    return [_snippet(doc) for doc in rank_context_documents(docs, limit=settings.INSTANT_SNIPPET_COUNT)]
+
+
+def format_snippets(snippets: list[dict]) -> str:
+    """Markdown answer listing the snippets with their timestamps, for clients that only show text."""
+    if not snippets:
+        return "I couldn't find where this is covered in the video."
+    lines = ["Here is where the video covers this:\n"]
+    for s in snippets:
+        lines.append(f"* **{s['timestamp']}** ({SOURCE_LABELS.get(s['type'], 'Context')}): {s['text']}")
+    return "\n".join(lines)
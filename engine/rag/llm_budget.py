@@ -0,0 +1,169 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+import contextvars
+from langchain_core.runnables import Runnable
+from .tracing import annotate
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+# Share of the budget the primary model gets to start answering when there is
+# a fallback, so the fallback still has time to answer within the budget
+PRIMARY_START_SHARE = 0.5
+
+
+class BudgetExceeded(TimeoutError):
+    """The model did not start or finish its answer within the route's wall-clock budget."""
+
+
+def fallbacks_from_config(config) -> list | None:
+    """The list (passed as `configurable['llm_fallbacks']`) that records the routes answered by the fallback model."""
+    return ((config or {}).get('configurable') or {}).get('llm_fallbacks')
+
+
+class BudgetedLLM(Runnable):
+    """
+    Runs `primary` within a wall-clock budget of `budget_seconds` for the
+    whole answer. With a `fallback` (a faster model), the primary has to
+    produce its first token within PRIMARY_START_SHARE of the budget, and
+    failing before producing anything also switches to the fallback. Once
+    tokens flow there is no switching back, and an answer still running when
+    the budget is spent is cut off with BudgetExceeded, as is a call with no
+    fallback that gets no output in time.
+    """
+
+    def __init__(self, primary: Runnable, fallback: Runnable | None, budget_seconds: float | None, route: str):
+        self.primary = primary
+        self.fallback = fallback
+        self.budget_seconds = budget_seconds
+        self.route = route
+
+    def _switch(self, error: Exception, config):
+        logger.warning(f"LLM for '{self.route}' fell back to {self.fallback.model}: {error}")
+        annotate(model=self.fallback.model, model_fallback=True)
+        fallbacks = fallbacks_from_config(config)
+        if fallbacks is not None:
+            fallbacks.append(self.route)
+        return self.fallback
+
+    def _deadlines(self) -> tuple[float, float]:
+        """(deadline for the primary's first token, deadline for the answer) on the monotonic clock."""
+        now = time.monotonic()
+        deadline = now + self.budget_seconds
+        if self.fallback is None:
+            return deadline, deadline
+        return now + self.budget_seconds * PRIMARY_START_SHARE, deadline
+
+    def _exceeded(self, llm: Runnable, started: bool) -> BudgetExceeded:
+        if started:
+            return BudgetExceeded(f"{llm.model} did not finish within {self.budget_seconds}s")
+        return BudgetExceeded(f"no output from {llm.model} within the {self.budget_seconds}s budget")
+
+    def _bounded_stream(self, llm: Runnable, first_deadline: float, deadline: float, input, config, kwargs):
+        # The model streams on a helper thread so each chunk can be awaited with a deadline
+        chunks = queue.Queue()
+        abandoned = threading.Event()
+
+        def produce():
+            iterator = llm.stream(input, config, **kwargs)
+            try:
+                for chunk in iterator:
+                    if abandoned.is_set():
+                        break  # closing the stream drops the connection, so Ollama stops generating
+                    chunks.put(chunk)
+                chunks.put(_DONE)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                iterator.close()
+
+        threading.Thread(target=contextvars.copy_context().run, args=(produce,), daemon=True).start()
+        try:
+            started = False
+            while True:
+                timeout = max(0.0, (deadline if started else first_deadline) - time.monotonic())
+                try:
+                    item = chunks.get(timeout=timeout)
+                except queue.Empty:
+                    raise self._exceeded(llm, started)
+                if item is _DONE:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                started = True
+                yield item
+        finally:
+            abandoned.set()
+
+    def stream(self, input, config=None, **kwargs):
+        annotate(model=self.primary.model)
+        if self.budget_seconds is None:
+            yield from self.primary.stream(input, config, **kwargs)
+            return
+
+        first_deadline, deadline = self._deadlines()
+        started = False
+        try:
+            for chunk in self._bounded_stream(self.primary, first_deadline, deadline, input, config, kwargs):
+                started = True
+                yield chunk
+            return
+        except Exception as e:
+            if started or self.fallback is None:
+                raise
+            fallback = self._switch(e, config)
+        yield from self._bounded_stream(fallback, deadline, deadline, input, config, kwargs)
+
+    def invoke(self, input, config=None, **kwargs):
+        message = None
+        for chunk in self.stream(input, config, **kwargs):
+            message = chunk if message is None else message + chunk
+        return message
+
+    async def _abounded_stream(self, llm: Runnable, first_deadline: float, deadline: float, input, config, kwargs):
+        iterator = llm.astream(input, config, **kwargs)
+        try:
+            started = False
+            while True:
+                timeout = max(0.0, (deadline if started else first_deadline) - time.monotonic())
+                try:
+                    chunk = await asyncio.wait_for(anext(iterator), timeout=timeout)
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    raise self._exceeded(llm, started)
+                started = True
+                yield chunk
+        finally:
+            await iterator.aclose()
+
+    async def astream(self, input, config=None, **kwargs):
+        annotate(model=self.primary.model)
+        if self.budget_seconds is None:
+            async for chunk in self.primary.astream(input, config, **kwargs):
+                yield chunk
+            return
+
+        first_deadline, deadline = self._deadlines()
+        started = False
+        try:
+            async for chunk in self._abounded_stream(self.primary, first_deadline, deadline, input, config, kwargs):
+                started = True
+                yield chunk
+            return
+        except Exception as e:
+            if started or self.fallback is None:
+                raise
+            fallback = self._switch(e, config)
+        async for chunk in self._abounded_stream(fallback, deadline, deadline, input, config, kwargs):
+            yield chunk
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        message = None
+        async for chunk in self.astream(input, config, **kwargs):
+            message = chunk if message is None else message + chunk
+        return message
@@ -0,0 +1,113 @@
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django_q.tasks import async_task
+from core.models import Conversation
+from .chains import get_conversation_summary_chain
+from .text import estimate_tokens, truncate_to_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def format_turn(message) -> str:
+    turn = f"User: {message.query}"
+    if message.answer:
+        turn += f"\nAssistant: {message.answer}"
+    return turn
+
+
+def _recent_turns(conversation: Conversation) -> tuple[list[str], int]:
+    """
+    The newest not-yet-summarized turns that fit in CHAT_HISTORY_MAX_TURNS and
+    what is left of CHAT_HISTORY_TOKEN_BUDGET after the summary (newest first),
+    plus how many unsummarized messages did not fit.
+    """
+    unsummarized = conversation.messages.count() - conversation.summarized_messages
+    if unsummarized <= 0:
+        return [], 0
+
+    budget = settings.CHAT_HISTORY_TOKEN_BUDGET - estimate_tokens(conversation.history_summary)
+    turns = []
+    for message in conversation.messages.order_by('-timestamp', '-id')[:min(unsummarized, settings.CHAT_HISTORY_MAX_TURNS)]:
+        turn = format_turn(message)
+        cost = estimate_tokens(turn)
+        if cost > budget:
+            if not turns and budget > 0:
+                # A single huge turn: keep its tail rather than nothing
+                turns.append(truncate_to_tokens(turn, budget, keep_end=True))
+            break
+        turns.append(turn)
+        budget -= cost
+    return turns, unsummarized - len(turns)
+
+
+def build_chat_history(conversation: Conversation) -> str:
+    """
+    Chat history for the prompt: the rolling summary of older turns followed
+    by the most recent turns verbatim, within CHAT_HISTORY_TOKEN_BUDGET.
+    Turns that no longer fit are folded into the summary in the background.
+    """
+    turns, overflow = _recent_turns(conversation)
+    if overflow > 0:
+        queue_history_fold(conversation.id)
+
+    parts = []
+    if conversation.history_summary:
+        parts.append(f"Summary of the earlier conversation: {conversation.history_summary}")
+    parts.extend(reversed(turns))
+    return "\n".join(parts)
+
+
+def _fold_queued_key(conversation_id: int) -> str:
+    return f"conversation-fold-queued:{conversation_id}"
+
+
+def queue_history_fold(conversation_id: int):
+    if cache.add(_fold_queued_key(conversation_id), True, timeout=600):
+        async_task('engine.tasks.task_fold_conversation_history', conversation_id)
+        logger.info(f"Queued history fold for conversation {conversation_id}")
+
+
+def fold_conversation_history(conversation_id: int):
+    """
+    Folds every unsummarized turn that no longer fits the verbatim window into
+    the conversation's rolling summary, CHAT_HISTORY_FOLD_BATCH messages per
+    LLM call. The summary is capped at CHAT_SUMMARY_MAX_TOKENS.
+
+    It folds past the overflow, leaving the window half full: the next turns
+    then only append to the history, so consecutive prompts share a prefix
+    that Ollama does not prefill again (see RAG_PROMPT).
+    """
+    try:
+        conversation = Conversation.objects.get(pk=conversation_id)
+        chain = get_conversation_summary_chain()
+        max_words = settings.CHAT_SUMMARY_MAX_TOKENS * 3 // 4
+        turns, overflow = _recent_turns(conversation)
+        if overflow <= 0:
+            return
+        target = conversation.summarized_messages + overflow + max(0, len(turns) - settings.CHAT_HISTORY_MAX_TURNS // 2)
+        while conversation.summarized_messages < target:
+            start = conversation.summarized_messages
+            batch = list(conversation.messages.order_by('timestamp', 'id')[start:min(target, start + settings.CHAT_HISTORY_FOLD_BATCH)])
+            if not batch:
+                break
+            summary = chain.invoke({
+                "summary": conversation.history_summary or "(none yet)",
+                "turns": "\n".join(format_turn(m) for m in batch),
+                "max_words": max_words,
+            }).strip()
+            summary = truncate_to_tokens(summary, settings.CHAT_SUMMARY_MAX_TOKENS)
+
+            # Only advance from the point we read; a concurrent fold wins otherwise
+            updated = Conversation.objects.filter(pk=conversation.pk, summarized_messages=start).update(
+                history_summary=summary,
+                summarized_messages=start + len(batch)
+            )
+            if not updated:
+                logger.info(f"Conversation {conversation_id} was folded concurrently; stopping.")
+                break
+            conversation.history_summary = summary
+            conversation.summarized_messages = start + len(batch)
+            logger.info(f"Folded {len(batch)} messages into the summary of conversation {conversation_id}.")
+    finally:
+        cache.delete(_fold_queued_key(conversation_id))
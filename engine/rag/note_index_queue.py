@@ -0,0 +1,85 @@
+import time
+import uuid
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django_q.models import Schedule
+from django_q.tasks import schedule
+
+logger = logging.getLogger(__name__)
+
+# How long a pending marker survives if its task never runs (e.g. queue cleared).
+# A task whose marker has expired still runs, so this only bounds how long a
+# lost task can hold back new ones.
+PENDING_TTL_SECONDS = 3 * 3600
+
+
+def _keys(user_id: int, video_id: str):
+    base = f"note-index:{user_id}:{video_id}"
+    return f"{base}:pending", f"{base}:due"
+
+
+def _schedule_update(user_id: int, video_id: str, token: str, queued_at: float, run_at: float):
+    # A one-off schedule instead of a task that sleeps, so no worker is held
+    # while the saves settle. The scheduler checks schedules every ~30s, which
+    # is fine for a background index refresh.
+    schedule(
+        'engine.tasks.task_update_note_index',
+        user_id=user_id,
+        video_id=video_id,
+        token=token,
+        queued_at=queued_at,
+        schedule_type=Schedule.ONCE,
+        next_run=timezone.now() + timedelta(seconds=max(0.0, run_at - time.time())),
+    )
+
+
+def queue_note_index_update(user_id: int, video_id: str):
+    """
+    Requests a note index update for (user, video), coalescing bursts.
+
+    Every call pushes the "due" time NOTE_INDEX_QUIET_SECONDS into the future,
+    but only the first call while no update is pending schedules a task for
+    the due time. The task carries a token; see claim_note_index_update.
+    """
+    pending_key, due_key = _keys(user_id, video_id)
+    now = time.time()
+    due = now + settings.NOTE_INDEX_QUIET_SECONDS
+    cache.set(due_key, due, timeout=PENDING_TTL_SECONDS)
+
+    token = uuid.uuid4().hex
+    if cache.add(pending_key, token, timeout=PENDING_TTL_SECONDS):
+        _schedule_update(user_id, video_id, token, queued_at=now, run_at=due)
+        logger.info(f"Scheduled note index update for user {user_id}, video {video_id}")
+    else:
+        logger.info(f"Note index update already pending for user {user_id}, video {video_id}; coalesced.")
+
+
+def claim_note_index_update(user_id: int, video_id: str, token: str, queued_at: float | None = None) -> bool:
+    """
+    Called at the start of the task. Claims the pending update once the notes
+    have been quiet for NOTE_INDEX_QUIET_SECONDS, or NOTE_INDEX_MAX_WAIT_SECONDS
+    after it was queued. If more saves came in, the task is scheduled again
+    for the new due time and False is returned, as it is when this task is a
+    duplicate whose token is no longer the pending one. An expired marker
+    counts as this task's own.
+
+    The pending marker is cleared before the rebuild reads any notes, so a
+    save that lands during the rebuild queues a fresh task.
+    """
+    pending_key, due_key = _keys(user_id, video_id)
+    if cache.get(pending_key) not in (token, None):
+        return False
+
+    now = time.time()
+    due = cache.get(due_key) or 0
+    if queued_at is not None:
+        due = min(due, queued_at + settings.NOTE_INDEX_MAX_WAIT_SECONDS)
+    if now < due:
+        _schedule_update(user_id, video_id, token, queued_at=queued_at or now, run_at=due)
+        return False
+
+    cache.delete(pending_key)
+    return True
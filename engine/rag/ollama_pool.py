@@ -0,0 +1,391 @@
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+import httpx
+import requests
+from ollama import ResponseError
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable
+from langchain_ollama import ChatOllama, OllamaEmbeddings
+
+logger = logging.getLogger(__name__)
+
+
+class NoBackendAvailable(ConnectionError):
+    """Every Ollama node in the pool is unhealthy or has its circuit open."""
+
+
+def is_node_failure(error: Exception) -> bool:
+    """Connection failures, timeouts and server errors: the node itself is in trouble."""
+    if isinstance(error, NoBackendAvailable):
+        return False
+    if isinstance(error, ResponseError):
+        return error.status_code >= 500
+    return isinstance(error, (ConnectionError, httpx.TransportError, requests.RequestException))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Worth trying on another node: node failures, a missing model or a busy node, but not bad requests."""
+    if isinstance(error, ResponseError) and error.status_code in (404, 429):
+        return True
+    return is_node_failure(error)
+
+
+def full_model_name(name: str) -> str:
+    """`name:tag`, with Ollama's implicit `:latest` added when no tag is given."""
+    return name if ':' in name.rsplit('/', 1)[-1] else f"{name}:latest"
+
+
+class BackendAffinity:
+    """
+    The node a conversation's previous turn ran on (`url`, '' if none). The
+    pool prefers it while it is not much busier than the least-loaded node,
+    since that node's KV cache still holds the conversation's prompt prefix,
+    and records the node actually used back into `url`.
+    """
+
+    def __init__(self, url: str = ""):
+        self.initial = url
+        self.url = url
+
+    @property
+    def changed(self) -> bool:
+        return self.url != self.initial
+
+
+def affinity_from_config(config) -> BackendAffinity | None:
+    return ((config or {}).get('configurable') or {}).get('ollama_affinity')
+
+
+class OllamaNode:
+    """
+    One Ollama endpoint with its load, health and circuit breaker. The circuit
+    opens after `OLLAMA_CIRCUIT_FAILURES` consecutive failed calls; once
+    `OLLAMA_CIRCUIT_RESET_SECONDS` have passed a single trial call is let
+    through (half-open), and its outcome closes or reopens the circuit.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip('/')
+        self.in_flight = 0
+        self.healthy = True
+        self.models = None  # names from /api/tags, None until probed
+        self.loaded_models = []  # names from /api/ps
+        self.last_probe = None
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+        self.latency_ms = None  # moving average of successful calls
+
+    def has_model(self, model: str | None) -> bool:
+        if model is None or self.models is None:
+            return True
+        model = full_model_name(model)
+        return any(full_model_name(name) == model for name in self.models)
+
+    def available(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        if self.state == 'open':
+            return now - self.opened_at >= settings.OLLAMA_CIRCUIT_RESET_SECONDS
+        if self.state == 'half_open':
+            return not self.trial_in_flight
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'circuit': self.state,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'failures': self.failures,
+            'latency_ms_avg': round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            'models': self.models,
+            'loaded_models': self.loaded_models,
+            'last_probe': self.last_probe,
+        }
+
+
+class OllamaPool:
+    """
+    Spreads calls over several Ollama endpoints. Each call goes to the
+    healthy node with the fewest calls in flight (ties: lowest average
+    latency, then random) among those that have the model, and is retried
+    on another node when it fails with a retryable error. A background
+    thread probes every node's /api/tags and /api/ps each
+    OLLAMA_HEALTH_INTERVAL_SECONDS (0 disables it).
+    """
+
+    def __init__(self, name: str, urls: list[str], retries: int | None = None):
+        if not urls:
+            raise ValueError(f"Ollama pool '{name}' needs at least one URL")
+        self.name = name
+        self.nodes = [OllamaNode(url) for url in urls]
+        self.retries = settings.OLLAMA_POOL_RETRIES if retries is None else retries
+        self._lock = threading.Lock()
+        self._prober = None
+
+    # --- routing ---
+
+    def _pick(self, model: str | None, exclude: set, affinity: BackendAffinity | None = None) -> OllamaNode:
+        self._ensure_probing()
+        now = time.monotonic()
+        with self._lock:
+            candidates = [n for n in self.nodes if n.url not in exclude and n.available(now)]
+            with_model = [n for n in candidates if n.has_model(model)]
+            candidates = with_model or candidates
+            if not candidates:
+                raise NoBackendAvailable(f"No Ollama node available in the '{self.name}' pool")
+            node = min(candidates, key=lambda n: (
+                n.in_flight,
+                n.latency_ms if n.latency_ms is not None else 0.0,
+                random.random()
+            ))
+            if affinity is not None and affinity.url != node.url:
+                preferred = next((n for n in candidates if n.url == affinity.url), None)
+                if preferred is not None and preferred.in_flight <= node.in_flight + settings.OLLAMA_AFFINITY_SLACK:
+                    node = preferred
+            if node.state == 'open':
+                node.state = 'half_open'
+                logger.info(f"Ollama node {node.url} circuit half-open; sending a trial request.")
+            if node.state == 'half_open':
+                node.trial_in_flight = True
+            node.in_flight += 1
+            node.requests += 1
+            if affinity is not None:
+                affinity.url = node.url
+            return node
+
+    def _succeeded(self, node: OllamaNode, elapsed_ms: float):
+        with self._lock:
+            node.in_flight -= 1
+            node.trial_in_flight = False
+            node.consecutive_failures = 0
+            if node.state != 'closed':
+                logger.info(f"Ollama node {node.url} circuit closed.")
+            node.state = 'closed'
+            node.latency_ms = elapsed_ms if node.latency_ms is None else 0.8 * node.latency_ms + 0.2 * elapsed_ms
+
+    def _failed(self, node: OllamaNode, error: Exception, counts: bool):
+        with self._lock:
+            node.in_flight -= 1
+            node.trial_in_flight = False
+            if not counts:
+                return
+            node.failures += 1
+            node.consecutive_failures += 1
+            if node.state == 'half_open' or node.consecutive_failures >= settings.OLLAMA_CIRCUIT_FAILURES:
+                if node.state != 'open':
+                    logger.warning(f"Ollama node {node.url} circuit opened after: {error}")
+                node.state = 'open'
+                node.opened_at = time.monotonic()
+
+    @contextmanager
+    def node(self, model: str | None = None, exclude: set = frozenset(), affinity: BackendAffinity | None = None):
+        """Holds the chosen node for one call; the outcome feeds its metrics and circuit."""
+        node = self._pick(model, exclude, affinity)
+        started = time.perf_counter()
+        try:
+            yield node
+        except BaseException as e:
+            self._failed(node, e, counts=isinstance(e, Exception) and is_node_failure(e))
+            raise
+        self._succeeded(node, (time.perf_counter() - started) * 1000)
+
+    def _should_retry(self, node: OllamaNode, error: Exception, attempt: int, tried: set) -> bool:
+        if isinstance(error, NoBackendAvailable) or not is_retryable(error) or attempt >= self.retries:
+            return False
+        logger.warning(f"Ollama call to {node.url} failed ({error}); retrying on another node.")
+        tried.add(node.url)
+        if len(tried) == len(self.nodes):
+            tried.clear()  # every node failed once: start over rather than give up early
+        return True
+
+    def call(self, fn, model: str | None = None, affinity: BackendAffinity | None = None):
+        """Runs `fn(node)`, moving to another node on retryable errors."""
+        tried = set()
+        for attempt in range(self.retries + 1):
+            node = None
+            try:
+                with self.node(model, tried, affinity) as node:
+                    return fn(node)
+            except Exception as e:
+                if not self._should_retry(node, e, attempt, tried):
+                    raise
+
+    async def acall(self, fn, model: str | None = None, affinity: BackendAffinity | None = None):
+        """`call` for a coroutine function `fn(node)`."""
+        tried = set()
+        for attempt in range(self.retries + 1):
+            node = None
+            try:
+                with self.node(model, tried, affinity) as node:
+                    return await fn(node)
+            except Exception as e:
+                if not self._should_retry(node, e, attempt, tried):
+                    raise
+
+    def stream(self, fn, model: str | None = None, affinity: BackendAffinity | None = None):
+        """
+        Yields from `fn(node)`. A failure before the first chunk is retried on
+        another node; once output has been yielded the error is raised.
+        """
+        tried = set()
+        for attempt in range(self.retries + 1):
+            node = None
+            started = False
+            try:
+                with self.node(model, tried, affinity) as node:
+                    for chunk in fn(node):
+                        started = True
+                        yield chunk
+                    return
+            except Exception as e:
+                if started or not self._should_retry(node, e, attempt, tried):
+                    raise
+
+    async def astream(self, fn, model: str | None = None, affinity: BackendAffinity | None = None):
+        """`stream` for an async iterator `fn(node)`."""
+        tried = set()
+        for attempt in range(self.retries + 1):
+            node = None
+            started = False
+            try:
+                with self.node(model, tried, affinity) as node:
+                    async for chunk in fn(node):
+                        started = True
+                        yield chunk
+                    return
+            except Exception as e:
+                if started or not self._should_retry(node, e, attempt, tried):
+                    raise
+
+    # --- health ---
+
+    def probe(self):
+        """One health check of every node, as check_models.py does by hand."""
+        for node in self.nodes:
+            timeout = settings.OLLAMA_HEALTH_TIMEOUT_SECONDS
+            try:
+                tags = requests.get(f"{node.url}/api/tags", timeout=timeout)
+                tags.raise_for_status()
+                models = [m['name'] for m in tags.json().get('models', [])]
+                try:
+                    ps = requests.get(f"{node.url}/api/ps", timeout=timeout)
+                    loaded = [m['name'] for m in ps.json().get('models', [])] if ps.ok else []
+                except (requests.RequestException, ValueError):
+                    loaded = []
+                healthy = True
+            except (requests.RequestException, ValueError, KeyError) as e:
+                models, loaded, healthy = node.models, [], False
+                if node.healthy:
+                    logger.warning(f"Ollama node {node.url} failed its health check: {e}")
+
+            with self._lock:
+                if healthy and not node.healthy:
+                    logger.info(f"Ollama node {node.url} is healthy again.")
+                node.healthy = healthy
+                node.models = models
+                node.loaded_models = loaded
+                node.last_probe = time.time()
+
+    def _ensure_probing(self):
+        interval = settings.OLLAMA_HEALTH_INTERVAL_SECONDS
+        if self._prober is not None or not interval:
+            return
+        with self._lock:
+            if self._prober is not None:
+                return
+            self._prober = threading.Thread(target=self._probe_forever, args=(interval,), name=f"ollama-probe-{self.name}", daemon=True)
+            self._prober.start()
+
+    def _probe_forever(self, interval: float):
+        while True:
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"Ollama health probe for the '{self.name}' pool failed: {e}")
+            time.sleep(interval)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'nodes': [n.stats() for n in self.nodes]}
+
+
+chat_pool = OllamaPool('chat', settings.OLLAMA_BASE_URLS)
+embedding_pool = (
+    chat_pool if settings.OLLAMA_EMBEDDING_BASE_URLS == settings.OLLAMA_BASE_URLS
+    else OllamaPool('embedding', settings.OLLAMA_EMBEDDING_BASE_URLS)
+)
+
+
+class PooledChatOllama(Runnable):
+    """
+    Drop-in for a ChatOllama in a chain: each call (invoke, stream and their
+    async forms) runs on a ChatOllama bound to the node the pool picks.
+    `params` are the ChatOllama arguments other than base_url. A
+    BackendAffinity in the run config's configurable['ollama_affinity']
+    steers the call towards a conversation's previous node.
+    """
+
+    def __init__(self, pool: OllamaPool, **params):
+        self.pool = pool
+        self.params = params
+        self._clients = {}
+
+    @property
+    def model(self) -> str:
+        return self.params['model']
+
+    def client(self, node: OllamaNode) -> ChatOllama:
+        client = self._clients.get(node.url)
+        if client is None:
+            client = self._clients.setdefault(node.url, ChatOllama(base_url=node.url, **self.params))
+        return client
+
+    def invoke(self, input, config=None, **kwargs):
+        return self.pool.call(lambda node: self.client(node).invoke(input, config, **kwargs), self.model, affinity_from_config(config))
+
+    async def ainvoke(self, input, config=None, **kwargs):
+        return await self.pool.acall(lambda node: self.client(node).ainvoke(input, config, **kwargs), self.model, affinity_from_config(config))
+
+    def stream(self, input, config=None, **kwargs):
+        yield from self.pool.stream(lambda node: self.client(node).stream(input, config, **kwargs), self.model, affinity_from_config(config))
+
+    async def astream(self, input, config=None, **kwargs):
+        async for chunk in self.pool.astream(lambda node: self.client(node).astream(input, config, **kwargs), self.model, affinity_from_config(config)):
+            yield chunk
+
+
+class PooledOllamaEmbeddings(Embeddings):
+    """OllamaEmbeddings spread over a pool, one call per node pick."""
+
+    def __init__(self, pool: OllamaPool, **params):
+        self.pool = pool
+        self.params = params
+        self._clients = {}
+
+    def client(self, node: OllamaNode) -> OllamaEmbeddings:
+        client = self._clients.get(node.url)
+        if client is None:
+            client = self._clients.setdefault(node.url, OllamaEmbeddings(base_url=node.url, **self.params))
+        return client
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.pool.call(lambda node: self.client(node).embed_documents(texts), model=self.params.get('model'))
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.pool.call(lambda node: self.client(node).embed_query(text), model=self.params.get('model'))
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        return await self.pool.acall(lambda node: self.client(node).aembed_documents(texts), model=self.params.get('model'))
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return await self.pool.acall(lambda node: self.client(node).aembed_query(text), model=self.params.get('model'))
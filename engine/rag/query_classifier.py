@@ -0,0 +1,108 @@
+import os
+import re
+import json
+import logging
+from dataclasses import dataclass
+from functools import lru_cache
+import numpy as np
+from django.conf import settings
+from .vector_store.config import embed_query_cached, get_indexing_embeddings
+
+logger = logging.getLogger(__name__)
+
+LABELS = ('Fetch_Notes', 'RAG', 'General')
+
+LABELLED_QUERIES_PATH = os.path.join(os.path.dirname(__file__), 'data', 'query_labels.json')
+
+# High-precision patterns; anything they don't match goes to centroid scoring.
+RULES = [
+    # Only when nothing topical follows "notes": "get the main point from the
+    # notes on recursion" is a content question, not a listing request.
+    ('Fetch_Notes', re.compile(
+        r"\b(show|list|see|view|get|give|display|fetch|open|print|pull up|bring up)\b.{0,30}\b(my|all( of)?( my)?|the) (personal |saved )?notes"
+        r"( (i('ve| have)? (took|taken|made|wrote|written|saved)( earlier| so far)?|(for|on|from|in) (this|the) (video|lecture|lesson)|here|please))?"
+        r"[\s?.!]*$",
+        re.IGNORECASE
+    )),
+    ('Fetch_Notes', re.compile(r"\b(what|which|any) notes (do|did) i\b", re.IGNORECASE)),
+    ('General', re.compile(
+        r"^\s*(hi|hello|hey|yo|thanks|thank you|good (morning|afternoon|evening)|who are you|what('s| is) your name)\b[\s!?.,]*(there|assistant)?[\s!?.]*$",
+        re.IGNORECASE
+    )),
+]
+
+
+@dataclass
+class Classification:
+    label: str
+    confidence: float
+    method: str  # 'rule', 'centroid' or 'llm'
+
+
+def load_labelled_queries(split: str | None = None) -> list[dict]:
+    with open(LABELLED_QUERIES_PATH) as f:
+        rows = json.load(f)
+    return [r for r in rows if split is None or r['split'] == split]
+
+
+@lru_cache(maxsize=1)
+def get_label_centroids() -> tuple[tuple[str, ...], np.ndarray]:
+    """
+    Unit-normalised mean embedding of the 'train' examples for each label.
+    Example embeddings go through the on-disk embedding cache, so this costs
+    one embedding round-trip per example only the first time ever.
+    """
+    examples = load_labelled_queries('train')
+    vectors = np.asarray(
+        get_indexing_embeddings().embed_documents([e['query'] for e in examples]),
+        dtype=np.float32
+    )
+    labels = np.array([e['label'] for e in examples])
+    centroids = []
+    for label in LABELS:
+        centroid = vectors[labels == label].mean(axis=0)
+        centroids.append(centroid / np.linalg.norm(centroid))
+    return LABELS, np.vstack(centroids)
+
+
+def classify_by_rules(query: str) -> Classification | None:
+    for label, pattern in RULES:
+        if pattern.search(query):
+            return Classification(label, 1.0, 'rule')
+    return None
+
+
+def classify_by_centroid(query: str) -> Classification:
+    """Nearest centroid by cosine similarity; confidence is the top-1 vs top-2 margin."""
+    labels, centroids = get_label_centroids()
+    vector = np.asarray(embed_query_cached(query), dtype=np.float32)
+    similarities = centroids @ (vector / np.linalg.norm(vector))
+    order = np.argsort(similarities)[::-1]
+    margin = float(similarities[order[0]] - similarities[order[1]])
+    return Classification(labels[order[0]], margin, 'centroid')
+
+
+def classify_query(query: str, llm_fallback=None) -> Classification:
+    """
+    Picks Fetch_Notes / RAG / General without an LLM call where possible:
+    regex rules first, then nearest-centroid scoring. `llm_fallback` (a
+    runnable taking {"question": ...}) is only invoked when the centroid
+    margin is below QUERY_CLASSIFIER_MIN_MARGIN or embedding fails.
+    """
+    result = classify_by_rules(query)
+    if result:
+        return result
+
+    try:
+        result = classify_by_centroid(query)
+        if result.confidence >= settings.QUERY_CLASSIFIER_MIN_MARGIN or llm_fallback is None:
+            return result
+        logger.info(f"Centroid classification '{result.label}' has low margin {result.confidence:.3f}; asking the LLM.")
+    except Exception as e:
+        logger.error(f"Local query classification failed: {e}")
+        if llm_fallback is None:
+            raise
+
+    answer = llm_fallback.invoke({"question": query}).strip()
+    label = next((l for l in ('Fetch_Notes', 'General') if l in answer), 'RAG')
+    return Classification(label, 0.0, 'llm')
@@ -0,0 +1,285 @@
+import os
+import asyncio
+import time
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from .tracing import annotate
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are coalesced
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def flight_key(*parts) -> str:
+    return hashlib.blake2b("\0".join(str(p) for p in parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class _Flight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.followers = 0
+        self.cond = threading.Condition()
+
+    def publish(self, chunk):
+        with self.cond:
+            self.chunks.append(chunk)
+            self.cond.notify_all()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent generations within a process. The first
+    caller for a key (the owner) runs `produce()`; callers that arrive while it
+    is running replay the chunks produced so far and then follow along, so
+    everyone receives the same stream. If the owner's consumer goes away
+    mid-stream, the owner still finishes the generation for its followers.
+    """
+
+    def __init__(self, wait_seconds: float):
+        self.wait_seconds = wait_seconds
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def stream(self, key: str, produce):
+        with self._lock:
+            flight = self._flights.get(key)
+            owner = flight is None
+            if owner:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.followers += 1
+
+        if owner:
+            return self._lead(key, flight, produce)
+        logger.info(f"Coalescing with in-flight request {key}.")
+        annotate(coalesced=True)
+        return self._follow(flight, produce)
+
+    def _lead(self, key, flight, produce):
+        iterator = iter(produce())
+        try:
+            for chunk in iterator:
+                flight.publish(chunk)
+                yield chunk
+        except GeneratorExit:
+            if flight.followers:
+                try:
+                    for chunk in iterator:
+                        flight.publish(chunk)
+                except Exception as e:
+                    flight.error = e
+            raise
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def _follow(self, flight, produce):
+        sent = 0
+        while True:
+            with flight.cond:
+                flight.cond.wait_for(lambda: len(flight.chunks) > sent or flight.done, timeout=self.wait_seconds)
+                chunks = flight.chunks[sent:]
+                done, error = flight.done, flight.error
+
+            for chunk in chunks:
+                yield chunk
+            sent += len(chunks)
+
+            if done:
+                if error is not None:
+                    raise error
+                return
+            if not chunks:
+                if sent:
+                    raise TimeoutError(f"Coalesced request stalled for {self.wait_seconds}s")
+                logger.warning(f"Coalesced request produced nothing in {self.wait_seconds}s; generating separately.")
+                yield from produce()
+                return
+
+
+class _AsyncFlight:
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for coroutines on one event loop. The generation runs as its
+    own task and every caller, the first included, follows it, so a client
+    disconnecting never cuts the answer short for the others.
+    """
+
+    def __init__(self, wait_seconds: float):
+        self.wait_seconds = wait_seconds
+        self._flights = {}
+        self._tasks = set()
+
+    def stream(self, key: str, produce):
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _AsyncFlight()
+            task = asyncio.get_running_loop().create_task(self._drain(key, flight, produce))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            logger.info(f"Coalescing with in-flight request {key}.")
+            annotate(coalesced=True)
+        return self._follow(flight)
+
+    async def _drain(self, key, flight, produce):
+        try:
+            async for chunk in produce():
+                flight.chunks.append(chunk)
+                flight.notify()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._flights.pop(key, None)
+            flight.done = True
+            flight.notify()
+
+    async def _follow(self, flight):
+        sent = 0
+        while True:
+            changed = flight.changed
+            if len(flight.chunks) > sent:
+                chunks = flight.chunks[sent:]
+                sent += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                continue
+            if flight.done:
+                if flight.error is not None:
+                    raise flight.error
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), timeout=self.wait_seconds)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Coalesced request stalled for {self.wait_seconds}s")
+
+
+def _lock_is_current(lock_file, path: str) -> bool:
+    """False when `path` was unlinked (and maybe recreated) since `lock_file` was opened."""
+    try:
+        return os.stat(path).st_ino == os.fstat(lock_file.fileno()).st_ino
+    except FileNotFoundError:
+        return False
+
+
+@contextmanager
+def _process_lock(key: str, wait_seconds: float):
+    """
+    Exclusive flock on a per-key file shared by all workers on this host.
+    Yields whether the lock had to be waited for (another worker was
+    generating). Gives up waiting after `wait_seconds` and proceeds unlocked.
+
+    The holder unlinks the file before unlocking, so a waiter can end up
+    locking an orphaned inode; it then reopens the path and waits again.
+    """
+    os.makedirs(settings.SINGLE_FLIGHT_LOCK_DIR, exist_ok=True)
+    path = os.path.join(settings.SINGLE_FLIGHT_LOCK_DIR, f"{key}.lock")
+    waited = False
+    give_up_at = time.monotonic() + wait_seconds
+    while True:
+        lock_file = open(path, 'a')
+        locked = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                locked = True
+                break
+            except BlockingIOError:
+                waited = True
+                if time.monotonic() >= give_up_at:
+                    logger.warning(f"Timed out waiting for the worker holding {key}; generating separately.")
+                    break
+                time.sleep(0.05)
+        if not locked or _lock_is_current(lock_file, path):
+            break
+        lock_file.close()  # the holder removed this file while we waited on it
+
+    try:
+        yield waited
+    finally:
+        if locked:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+
+def _across_processes(key: str, produce, wait_seconds: float):
+    """
+    Wraps `produce` so only one worker process generates a given key at a
+    time. A worker that had to wait reuses the answer the holder left in the
+    shared Django cache for SINGLE_FLIGHT_RESULT_TTL seconds.
+    """
+    result_key = f"single-flight:{key}:result"
+    with _process_lock(key, wait_seconds) as waited:
+        if waited:
+            result = cache.get(result_key)
+            if result is not None:
+                logger.info(f"Reusing answer another worker generated for {key}.")
+                yield result
+                return
+        chunks = []
+        for chunk in produce():
+            chunks.append(chunk)
+            yield chunk
+        cache.set(result_key, "".join(chunks), timeout=settings.SINGLE_FLIGHT_RESULT_TTL)
+
+
+single_flight = SingleFlight(wait_seconds=settings.SINGLE_FLIGHT_WAIT_SECONDS)
+
+
+def coalesce(key: str, produce):
+    """
+    Runs `produce()` (a callable returning an iterable of answer chunks)
+    unless an identical request is already in flight, in which case its
+    chunks are shared. SINGLE_FLIGHT_MODE: 'off', 'thread' (one process)
+    or 'file' (also across worker processes on this host, via flock).
+    """
+    mode = settings.SINGLE_FLIGHT_MODE
+    if mode == 'off':
+        return iter(produce())
+    if mode == 'file' and fcntl is not None:
+        wait_seconds = single_flight.wait_seconds
+        return single_flight.stream(key, lambda: _across_processes(key, produce, wait_seconds))
+    return single_flight.stream(key, produce)
+
+
+async_single_flight = AsyncSingleFlight(wait_seconds=settings.SINGLE_FLIGHT_WAIT_SECONDS)
+
+
+def acoalesce(key: str, produce):
+    """
+    `coalesce` for the async endpoint: `produce()` returns an async iterable.
+    Coalescing is per event loop, since the flock mode would block the loop.
+    """
+    if settings.SINGLE_FLIGHT_MODE == 'off':
+        return produce()
+    return async_single_flight.stream(key, produce)
@@ -0,0 +1,73 @@
+import re
+import logging
+from django.conf import settings
+from core.models import Transcript, Video, VideoSummary
+from .chains import get_section_summary_chain, get_combine_summary_chain
+from .text import format_seconds
+from .vector_store.chunking import merge_into_time_windows
+from .versions import transcript_version, bump_generation
+
+logger = logging.getLogger(__name__)
+
+# "summarize", "give me a summary of this video", "tldr please", ...
+PLAIN_SUMMARY_REQUEST = re.compile(
+    r"^(can you |could you |please )?(give me |write )?(a |an )?(short |quick |brief )?"
+    r"(summarize|summarise|summary|overview|tldr|tl;dr|key points)"
+    r"( of| for)?( this| the)?( video| lecture| lesson)?( please)?$",
+    re.IGNORECASE
+)
+
+
+def is_plain_summary_request(query: str) -> bool:
+    return bool(PLAIN_SUMMARY_REQUEST.match(query.strip().rstrip('?.!').strip()))
+
+
+def build_video_summary(video: Video) -> VideoSummary | None:
+    """
+    Map-reduce summary of a video's transcript: each SUMMARY_CHUNK_SECONDS
+    window is summarized on its own, then the section summaries are combined
+    SUMMARY_REDUCE_FANIN at a time until a single summary remains.
+    The result is stored against the current transcript version.
+    """
+    version = transcript_version(video)
+    rows = Transcript.objects.filter(video=video).order_by('start').values_list('start', 'content')
+    windows = merge_into_time_windows(rows, window_seconds=settings.SUMMARY_CHUNK_SECONDS, end_of_video=video.duration)
+    if not windows:
+        logger.warning(f"No transcript to summarize for video {video.id}.")
+        return None
+
+    logger.info(f"Summarizing video {video.id} in {len(windows)} sections.")
+    batch_config = {"max_concurrency": settings.SUMMARY_MAX_CONCURRENCY}
+    section_chain = get_section_summary_chain()
+    sections = section_chain.batch([
+        {"start": format_seconds(w['start']), "end": format_seconds(w['end']), "context": w['content']}
+        for w in windows
+    ], config=batch_config)
+    sections = [
+        {'start': w['start'], 'end': w['end'], 'summary': text.strip()}
+        for w, text in zip(windows, sections)
+    ]
+
+    layer = [f"({format_seconds(s['start'])} - {format_seconds(s['end'])})\n{s['summary']}" for s in sections]
+    combine_chain = get_combine_summary_chain()
+    fan_in = max(2, settings.SUMMARY_REDUCE_FANIN)
+    while len(layer) > 1:
+        groups = [layer[i:i + fan_in] for i in range(0, len(layer), fan_in)]
+        logger.info(f"Combining {len(layer)} summaries into {len(groups)} for video {video.id}.")
+        layer = [text.strip() for text in combine_chain.batch([{"context": "\n\n".join(g)} for g in groups], config=batch_config)]
+
+    summary, _ = VideoSummary.objects.update_or_create(
+        video=video,
+        defaults={'transcript_version': version, 'summary': layer[0], 'sections': sections}
+    )
+    bump_generation(video.pk)
+    logger.info(f"Stored summary for video {video.id} (transcript version {version}).")
+    return summary
+
+
+def get_stored_summary(video: Video) -> VideoSummary | None:
+    """Returns the stored summary if it was built from the current transcript."""
+    summary = VideoSummary.objects.filter(video=video).first()
+    if summary and summary.transcript_version == transcript_version(video):
+        return summary
+    return None
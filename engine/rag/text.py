@@ -0,0 +1,17 @@
+def format_seconds(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60}:{seconds % 60:02d}"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token); cheap enough to run on every turn."""
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    limit = max(max_tokens, 0) * 4
+    if len(text) <= limit:
+        return text
+    return "..." + text[-limit:] if keep_end else text[:limit] + "..."
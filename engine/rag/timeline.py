@@ -0,0 +1,120 @@
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from django.conf import settings
+from core.models import Transcript, OCRTranscript, VideoChapter
+from .versions import bump_generation, current_generation, transcript_version
+
+logger = logging.getLogger(__name__)
+
+MODALITIES = ('transcript', 'ocr')
+
+
+class TimelineTrack:
+    """One modality's segments, sorted by start time."""
+
+    def __init__(self, rows):
+        rows = sorted(rows, key=lambda r: r[0])
+        self.starts = np.fromiter((r[0] for r in rows), dtype=np.float64, count=len(rows))
+        self.contents = [r[1] for r in rows]
+
+    def __len__(self):
+        return len(self.contents)
+
+    def index_at(self, seconds: float) -> int:
+        """Index of the segment playing at `seconds` (last start <= seconds), or -1."""
+        return int(np.searchsorted(self.starts, seconds, side='right')) - 1
+
+    def segment_at(self, seconds: float) -> dict | None:
+        i = self.index_at(seconds)
+        if i < 0:
+            return None
+        return {'start': float(self.starts[i]), 'content': self.contents[i]}
+
+    def between(self, start: float, end: float) -> list[dict]:
+        """Segments on screen at any point in [start, end], including the one already playing at `start`."""
+        first = max(self.index_at(start), 0)
+        last = int(np.searchsorted(self.starts, end, side='right'))
+        return [{'start': float(self.starts[i]), 'content': self.contents[i]} for i in range(first, last)]
+
+
+class VideoTimeline:
+    """Transcript and OCR segments of one video, and its up-to-date chapters, indexed by time."""
+
+    def __init__(self, transcript_rows, ocr_rows, generation=None, chapters=()):
+        self.tracks = {'transcript': TimelineTrack(transcript_rows), 'ocr': TimelineTrack(ocr_rows)}
+        self.generation = generation
+        self.chapters = sorted(chapters, key=lambda c: c.start)
+        self.chapter_starts = np.fromiter((c.start for c in self.chapters), dtype=np.float64, count=len(self.chapters))
+
+    @property
+    def transcript(self) -> TimelineTrack:
+        return self.tracks['transcript']
+
+    @property
+    def ocr(self) -> TimelineTrack:
+        return self.tracks['ocr']
+
+    def window(self, seconds: float, before: float, after: float) -> list[dict]:
+        """
+        Every transcript and OCR segment overlapping [seconds - before,
+        seconds + after], merged in start order. Each item carries its
+        'type' ('transcript' or 'ocr'), 'start' and 'content'.
+        """
+        segments = []
+        for modality in MODALITIES:
+            for segment in self.tracks[modality].between(seconds - before, seconds + after):
+                segment['type'] = modality
+                segments.append(segment)
+        segments.sort(key=lambda s: (s['start'], s['type']))
+        return segments
+
+    def chapter_at(self, seconds: float) -> VideoChapter | None:
+        """The chapter containing `seconds` (the first one for times before it), or None without chapters."""
+        if not self.chapters:
+            return None
+        i = int(np.searchsorted(self.chapter_starts, seconds, side='right')) - 1
+        return self.chapters[max(i, 0)]
+
+
+def invalidate_video_timeline(video_pk):
+    """Call after a video's Transcript, OCRTranscript or VideoChapter rows are rewritten."""
+    bump_generation(video_pk)
+    with _lock:
+        _timelines.pop(video_pk, None)
+
+
+_timelines: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_video_timeline(video) -> VideoTimeline:
+    """
+    The cached timeline for `video`, rebuilt when its generation changes.
+    Only chapters generated from the current transcript rows are kept.
+    """
+    generation = current_generation(video.pk)
+    with _lock:
+        timeline = _timelines.get(video.pk)
+        if timeline is not None and timeline.generation == generation:
+            _timelines.move_to_end(video.pk)
+            return timeline
+
+    timeline = VideoTimeline(
+        Transcript.objects.filter(video=video).values_list('start', 'content'),
+        OCRTranscript.objects.filter(video=video).values_list('start', 'content'),
+        generation=generation,
+        chapters=VideoChapter.objects.filter(video=video, transcript_version=transcript_version(video))
+    )
+    logger.info(
+        f"Built timeline for video {video.pk}: {len(timeline.transcript)} transcript, "
+        f"{len(timeline.ocr)} OCR segments, {len(timeline.chapters)} chapters."
+    )
+
+    with _lock:
+        _timelines[video.pk] = timeline
+        _timelines.move_to_end(video.pk)
+        while len(_timelines) > settings.VIDEO_TIMELINE_CACHE_SIZE:
+            _timelines.popitem(last=False)
+    return timeline
@@ -0,0 +1,169 @@
+import json
+import time
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from django.conf import settings
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+# Per-request records go to their own logger so they can be shipped separately
+record_logger = logging.getLogger('engine.rag.trace')
+
+_current_trace = contextvars.ContextVar('rag_trace', default=None)
+
+
+class Trace:
+    """
+    Stage timings (ms, summed when a stage repeats) and fields such as the
+    route taken and token counts for one assistant request.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+        self.fields: dict = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, ms: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def annotate(self, **fields):
+        with self._lock:
+            self.fields.update(fields)
+
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+
+    def server_timing(self) -> str:
+        """Value for the Server-Timing response header, stages so far plus `total`."""
+        with self._lock:
+            stages = list(self.stages.items())
+        stages.append(('total', self.elapsed_ms()))
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in stages)
+
+    def record(self) -> dict:
+        with self._lock:
+            return {
+                'trace': self.name,
+                'total_ms': round(self.elapsed_ms(), 1),
+                **self.fields,
+                'stages_ms': {stage: round(ms, 1) for stage, ms in self.stages.items()},
+            }
+
+
+def start_trace(name: str) -> Trace | None:
+    """
+    Starts tracing the current request with probability TRACE_SAMPLE_RATE and
+    makes it the current trace; returns None (and clears any leftover trace
+    on this thread) when the request is not sampled.
+    """
+    rate = settings.TRACE_SAMPLE_RATE
+    trace = Trace(name) if rate > 0 and random.random() < rate else None
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+def add_stage(stage: str, ms: float):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, ms)
+
+
+def annotate(**fields):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.annotate(**fields)
+
+
+@contextmanager
+def span(stage: str):
+    """Times the block as `stage` of the current trace, if there is one."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, (time.perf_counter() - started) * 1000)
+
+
+def finish_trace(trace: Trace | None, response=None):
+    """Sets the Server-Timing header on `response` (if given) and logs the request record."""
+    if trace is None:
+        return
+    if response is not None:
+        response['Server-Timing'] = trace.server_timing()
+    record_logger.info(json.dumps(trace.record(), default=str))
+
+
+def chain_config() -> dict:
+    """`config` for invoking a chain so its retriever and LLM calls land in the current trace."""
+    trace = _current_trace.get()
+    return {'callbacks': [TraceCallbackHandler(trace)]} if trace is not None else {}
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    Records the retrieval and LLM steps of a chain run: `retrieve`, `llm`,
+    `llm_first_token` (time to the first streamed token) and the model's
+    token counts as `tokens_in` / `tokens_out`.
+    """
+
+    def __init__(self, trace: Trace):
+        self.trace = trace
+        self._started = {}
+        self._first_token_seen = set()
+
+    def _start(self, run_id):
+        self._started[run_id] = time.perf_counter()
+
+    def _stop(self, run_id, stage: str):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            self.trace.add(stage, (time.perf_counter() - started) * 1000)
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._stop(run_id, 'retrieve')
+        self.trace.annotate(documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._stop(run_id, 'retrieve')
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id not in self._first_token_seen and run_id in self._started:
+            self._first_token_seen.add(run_id)
+            self.trace.add('llm_first_token', (time.perf_counter() - self._started[run_id]) * 1000)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._stop(run_id, 'llm')
+        self._first_token_seen.discard(run_id)
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None)
+                if usage:
+                    self.trace.annotate(tokens_in=usage.get('input_tokens'), tokens_out=usage.get('output_tokens'))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._stop(run_id, 'llm')
+        self._first_token_seen.discard(run_id)
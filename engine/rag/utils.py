@@ -1,13 +1,53 @@
 import re
+import time
 import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
 from django.db.models import Q 
 from django.shortcuts import get_object_or_404
+from django_q.tasks import async_task
+from langchain_core.runnables import RunnableLambda
 from .chains import get_rag_chain, get_time_based_chain, get_summarizer_chain, get_general_chain, get_query_type_classifier_chain
+from .query_classifier import classify_query, classify_by_rules
+from .vector_store.retriever import get_retriever
+from .summarizer import get_stored_summary, is_plain_summary_request
+from .text import format_seconds, estimate_tokens, truncate_to_tokens
+from .chapters import is_plain_time_request
+from .timeline import get_video_timeline
+from .answer_cache import answer_cache, get_video_pk, normalize_query
+from .single_flight import coalesce, acoalesce, flight_key
+from .admission import admission_controller
+from .tracing import span, annotate, add_stage, chain_config
+from .ollama_pool import BackendAffinity
 
-from core.models import Transcript, Note, Video 
+from core.models import Note, Video 
 
 logger = logging.getLogger(__name__)
 
+# Runs retrieval speculatively while the query is still being classified
+_speculation_executor = ThreadPoolExecutor(
+    max_workers=settings.RAG_SPECULATION_WORKERS,
+    thread_name_prefix='rag-speculate'
+)
+
+
+@dataclass
+class RoutedQuery:
+    """
+    Outcome of routing a query: either a ready `answer` (no LLM needed) or a
+    `chain` to run with `inputs`. `route` names the branch taken.
+    """
+    route: str
+    answer: str | None = None
+    chain: Any = None
+    inputs: dict | None = None
+
 
 def parse_time(query: str, timestamp: float) -> float | None:
     time_pattern = r"(\d{1,2}):(\d{1,2})(?::(\d{1,2}))?"
@@ -31,53 +71,98 @@ def parse_time(query: str, timestamp: float) -> float | None:
     return None
 
 
-def query_router(query: str, video_id: str, timestamp: float, chat_history: str, user_id: int | None):
-    
+def route_query(query: str, video_id: str, timestamp: float, chat_history: str, user_id: int | None, client_key: str) -> RoutedQuery:
+    """
+    Picks the chain (and its inputs) that should answer the query, or a
+    direct answer when no LLM generation is needed. Running the chain is
+    left to the caller so it can be invoked or streamed. The LLM classifier,
+    when it is needed, runs in one of `client_key`'s LLM slots.
+    """
     try:
-        video = get_object_or_404(Video, Q(youtube_id=video_id) | Q(vimeo_id=video_id))
+        with span('video'):
+            video = get_object_or_404(Video, Q(youtube_id=video_id) | Q(vimeo_id=video_id))
         logger.info(f"Query Router: Found video {video.pk} for platform ID {video_id}")
 
     except Exception as e:
          logger.error(f"Query Router: Could not find video for ID {video_id}: {e}")
-         return "Sorry, I couldn't identify the video associated with this request."
+         return RoutedQuery('error', answer="Sorry, I couldn't identify the video associated with this request.")
 
     summarization_keywords = ['summarize', 'summary', 'overview', 'tldr', 'key points']
     if any(keyword in query.lower() for keyword in summarization_keywords):
         logger.info("Routing to: Summarizer Chain")
-        transcripts_qs = Transcript.objects.filter(video=video).order_by('start')
+        stored = get_stored_summary(video)
+        if stored:
+            if is_plain_summary_request(query):
+                logger.info(f"Answering from stored summary for video {video.pk}")
+                return RoutedQuery('summary', answer=stored.summary)
+            # Tailor the stored summary to the request with one short call
+            return RoutedQuery('summary', chain=get_summarizer_chain(), inputs={"context": stored.summary, "question": query})
 
-        if not transcripts_qs.exists():
-             return "I couldn't find a transcript to summarize for this video."
-        full_transcript = " ".join(t.content for t in transcripts_qs)
+        logger.info(f"No current stored summary for video {video.pk}; queueing one and summarizing a transcript sample.")
+        if cache.add(f"video-summary-queued:{video.pk}", True, timeout=3600):
+            async_task('engine.tasks.task_generate_video_summary', video.pk)
+        transcript = get_video_timeline(video).transcript
 
-        summarizer_chain = get_summarizer_chain()
-        return summarizer_chain.invoke({"context": full_transcript, "question": query})
+        if not len(transcript):
+             return RoutedQuery('summary', answer="I couldn't find a transcript to summarize for this video.")
+        context = _sample_transcript(transcript, settings.SUMMARY_SAMPLE_TOKENS)
+
+        return RoutedQuery('summary', chain=get_summarizer_chain(), inputs={"context": context, "question": query})
 
     parsed_seconds = parse_time(query, timestamp)
     if parsed_seconds is not None:
         logger.info(f"Routing to: Time-Based Chain (Time: {parsed_seconds}s)")
-        try:
-            transcript_segment = Transcript.objects.filter(video=video, start__lte=parsed_seconds).latest('start')
-            context = transcript_segment.content
-            
-            time_chain = get_time_based_chain()
-            return time_chain.invoke({"context": context, "question": query})
-        except Transcript.DoesNotExist:
-             logger.warning(f"No transcript segment found for video {video.pk} at or before {parsed_seconds}s")
-             logger.info("Time-based segment not found, falling back to RAG.")
-             pass
+        timeline = get_video_timeline(video)
+        chapter = timeline.chapter_at(parsed_seconds)
+        if chapter and is_plain_time_request(query):
+            logger.info(f"Answering from stored chapter '{chapter.title}' for video {video.pk}")
+            return RoutedQuery('time', answer=(
+                f"At {format_seconds(parsed_seconds)} the video is in the chapter **{chapter.title}** "
+                f"({format_seconds(chapter.start)} - {format_seconds(chapter.end)}).\n\n{chapter.description}"
+            ))
+        # Chapters are missing or were built from an older transcript, and
+        # there is a transcript to build them from
+        if not timeline.chapters and len(timeline.transcript) and cache.add(f"video-chapters-queued:{video.pk}", True, timeout=3600):
+            async_task('engine.tasks.task_generate_video_chapters', video.pk)
+
+        if timeline.transcript.index_at(parsed_seconds) >= 0:
+            segments = timeline.window(parsed_seconds, settings.TIME_CONTEXT_BEFORE_SECONDS, settings.TIME_CONTEXT_AFTER_SECONDS)
+            context = "\n".join(
+                f"[{format_seconds(s['start'])}] {'(on screen) ' if s['type'] == 'ocr' else ''}{s['content']}"
+                for s in segments
+            )
+            if chapter:
+                context = f"Chapter: {chapter.title} - {chapter.description}\n\nAround {format_seconds(parsed_seconds)}:\n{context}"
+
+            return RoutedQuery('time', chain=get_time_based_chain(), inputs={"context": context, "question": query})
+
+        logger.warning(f"No transcript segment found for video {video.pk} at or before {parsed_seconds}s")
+        logger.info("Time-based segment not found, falling back to RAG.")
 
 
     logger.info("Routing to: Query Type Classifier")
-    classifier_chain = get_query_type_classifier_chain()
+    speculative = None
+    if settings.RAG_SPECULATIVE_RETRIEVAL and classify_by_rules(query) is None:
+        # Most questions end up on the RAG branch: load the indexes and search
+        # them while the classifier decides, and throw the result away otherwise.
+        speculative = _speculation_executor.submit(contextvars.copy_context().run, _speculative_retrieve, query, video_id, user_id)
+
     try:
-        classification = classifier_chain.invoke({"question": query}).strip()
-        logger.info(f"Classification result: {classification}")
+        # Rules and embedding centroids first; the LLM classifier only on low confidence
+        with span('classify'):
+            result = classify_query(query, llm_fallback=RunnableLambda(lambda inputs: _admitted_classify(inputs, client_key)))
+        classification = result.label
+        annotate(classifier=result.method)
+        logger.info(f"Classification result: {classification} (method: {result.method}, confidence: {result.confidence:.3f})")
     except Exception as e:
         logger.error(f"Query classification failed: {e}. Defaulting to RAG.")
         classification = "RAG" # Default to RAG on classifier error
 
  
+    if speculative is not None and ("Fetch_Notes" in classification or "General" in classification):
+        speculative.cancel()
+        logger.info(f"Discarding speculative retrieval (route: {classification}).")
+
     if "Fetch_Notes" in classification:
         if user_id is None:
             logger.warning("Classifier requested 'Fetch_Notes' but no user_id is present. Falling back to Rag.")
@@ -91,7 +176,7 @@ def query_router(query: str, video_id: str, timestamp: float, chat_history: str,
         ).order_by('video_timestamp')
         
         if not notes.exists():
-            return "You haven't created any notes for this video yet."
+            return RoutedQuery('notes', answer="You haven't created any notes for this video yet.")
         
         response_message = "Here are your notes for this video:\n\n"
         for note in notes:
@@ -103,15 +188,212 @@ def query_router(query: str, video_id: str, timestamp: float, chat_history: str,
             content_preview = note.content[:200] + ('...' if len(note.content) > 200 else '')
             response_message += f"    * {content_preview}\n"
         
-        return response_message
+        return RoutedQuery('notes', answer=response_message)
 
     if "General" in classification:
         logger.info("Routing to: General Chain")
-        return get_general_chain().invoke({"question": query})
+        return RoutedQuery('general', chain=get_general_chain(), inputs={"question": query})
 
     logger.info("Routing to: Standard RAG Chain")
-    rag_chain = get_rag_chain(video_id, user_id=user_id) 
-    return rag_chain.invoke({
+    documents = None
+    if speculative is not None and speculative.cancel():
+        # Still queued behind other speculations: retrieving in the chain is no slower
+        logger.info("Speculative retrieval had not started; retrieving inline.")
+    elif speculative is not None:
+        try:
+            with span('speculation_wait'):
+                documents = speculative.result()
+            logger.info(f"Using {len(documents)} speculatively retrieved documents.")
+        except Exception as e:
+            logger.error(f"Speculative retrieval failed: {e}. Retrieving again.")
+    rag_chain = get_rag_chain(video_id, user_id=user_id, documents=documents) 
+    return RoutedQuery('rag', chain=rag_chain, inputs={
         "question": query,
         "chat_history": chat_history
-    })
\ No newline at end of file
+    })
+
+
+def _sample_transcript(track, max_tokens: int, excerpts: int = 8) -> str:
+    """
+    The whole transcript if it fits in `max_tokens`, otherwise `excerpts`
+    evenly spaced runs of consecutive segments sharing the budget, each
+    headed by its timestamp.
+    """
+    if sum(estimate_tokens(c) for c in track.contents) <= max_tokens:
+        return " ".join(track.contents)
+    parts = []
+    per_excerpt = max_tokens // excerpts
+    for n in range(excerpts):
+        first = i = n * len(track) // excerpts
+        texts, used = [], 0
+        while i < len(track) and used < per_excerpt:
+            texts.append(track.contents[i])
+            used += estimate_tokens(track.contents[i])
+            i += 1
+        parts.append(f"[{format_seconds(track.starts[first])}] {truncate_to_tokens(' '.join(texts), per_excerpt)}")
+    return "\n\n".join(parts)
+
+
+def _admitted_classify(inputs: dict, client_key: str) -> str:
+    # Counts against the same LLM slots as answers, so a burst of ambiguous
+    # questions cannot overload the model past admission control
+    queued = time.perf_counter()
+    with admission_controller.slot(client_key):
+        add_stage('queue', (time.perf_counter() - queued) * 1000)
+        return get_query_type_classifier_chain().invoke(inputs)
+
+
+def _speculative_retrieve(query: str, video_id: str, user_id: int | None):
+    close_old_connections()
+    try:
+        with span('retrieve'):
+            return get_retriever(video_id, user_id=user_id).invoke(query)
+    finally:
+        close_old_connections()
+
+
+def db_sync_to_async(func):
+    """
+    `sync_to_async(func, thread_sensitive=False)` for functions that touch the
+    ORM: they run on a pool thread that outlives the request, so stale
+    connections are closed around the call, as for speculative retrieval.
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+def _lookup_cached_answer(query: str, video_id: str, timestamp: float, chat_history: str, user_id: int | None):
+    """
+    Returns (answer, store) where `answer` is a cached answer or None, and
+    `store(route, answer)` records a freshly generated one (a no-op when the
+    question is not cacheable).
+    """
+    def skip(route, answer):
+        pass
+
+    if not settings.ANSWER_CACHE_ENABLED or parse_time(query, timestamp) is not None:
+        return None, skip
+    try:
+        video_pk = get_video_pk(video_id)
+        if video_pk is None:
+            return None, skip
+        with span('cache'):
+            generations = answer_cache.generations(video_pk, user_id)
+            hit = answer_cache.lookup(video_pk, query, user_id, bool(chat_history))
+    except Exception as e:
+        logger.error(f"Answer cache lookup failed: {e}")
+        return None, skip
+
+    if hit:
+        logger.info(f"Answer cache hit for video {video_id} (route: {hit.route}).")
+        annotate(route=hit.route, cache='hit')
+        return hit.answer, skip
+    annotate(cache='miss')
+
+    def store(route, answer):
+        try:
+            answer_cache.store(video_pk, query, route, answer, user_id, bool(chat_history), generations)
+        except Exception as e:
+            logger.error(f"Answer cache store failed: {e}")
+    return None, store
+
+
+def _run_config(affinity: BackendAffinity | None, fallbacks: list) -> dict:
+    """Chain config carrying the trace callbacks, the Ollama affinity and the list that records model fallbacks."""
+    config = chain_config()
+    config['configurable'] = {'llm_fallbacks': fallbacks}
+    if affinity is not None:
+        config['configurable']['ollama_affinity'] = affinity
+    return config
+
+
+def _generate_answer(query: str, video_id: str, timestamp: float, chat_history: str, user_id: int | None, client_key: str, store, stream: bool, affinity: BackendAffinity | None = None):
+    with span('route'):
+        routed = route_query(query, video_id, timestamp, chat_history, user_id, client_key)
+    annotate(route=routed.route)
+    if routed.answer is not None:
+        yield routed.answer
+        return
+    # Wait for (or be refused) one of the worker's LLM slots
+    queued = time.perf_counter()
+    fallbacks = []
+    with admission_controller.slot(client_key):
+        add_stage('queue', (time.perf_counter() - queued) * 1000)
+        if stream:
+            chunks = []
+            for chunk in routed.chain.stream(routed.inputs, config=_run_config(affinity, fallbacks)):
+                chunks.append(chunk)
+                yield chunk
+            answer = "".join(chunks)
+        else:
+            answer = routed.chain.invoke(routed.inputs, config=_run_config(affinity, fallbacks))
+            yield answer
+    # An answer from the fallback model is not kept in place of the route model's
+    if not fallbacks:
+        store(routed.route, answer)
+
+
+def _coalesced_answer(query: str, video_id: str, timestamp: float, chat_history: str, user_id: int | None, client_key: str | None, stream: bool, affinity: BackendAffinity | None):
+    """Cached answer if there is one, else the (possibly shared) generation for this exact request."""
+    cached, store = _lookup_cached_answer(query, video_id, timestamp, chat_history, user_id)
+    if cached is not None:
+        return iter([cached])
+    if client_key is None:
+        client_key = f"user:{user_id}" if user_id is not None else "public"
+    key = flight_key(video_id, normalize_query(query), user_id, chat_history, parse_time(query, timestamp))
+    return coalesce(key, lambda: _generate_answer(query, video_id, timestamp, chat_history, user_id, client_key, store, stream, affinity))
+
+
+def query_router(query: str, video_id: str, timestamp: float, chat_history: str, user_id: int | None, client_key: str | None = None, affinity: BackendAffinity | None = None) -> str:
+    """
+    Answers the query. `client_key` identifies the caller for fair LLM
+    queuing (defaults to the user); raises AdmissionRejected when the LLM is saturated.
+    `affinity` (the conversation's last Ollama node) is updated to the node used.
+    """
+    return "".join(_coalesced_answer(query, video_id, timestamp, chat_history, user_id, client_key, stream=False, affinity=affinity))
+
+
+def stream_query_router(query: str, video_id: str, timestamp: float, chat_history: str, user_id: int | None, client_key: str | None = None, affinity: BackendAffinity | None = None):
+    """Same routing as query_router, but yields the answer in chunks as the LLM produces them."""
+    yield from _coalesced_answer(query, video_id, timestamp, chat_history, user_id, client_key, stream=True, affinity=affinity)
+
+
+async def _agenerate_answer(query: str, video_id: str, timestamp: float, chat_history: str, user_id: int | None, client_key: str, store, affinity: BackendAffinity | None = None):
+    with span('route'):
+        routed = await db_sync_to_async(route_query)(query, video_id, timestamp, chat_history, user_id, client_key)
+    annotate(route=routed.route)
+    if routed.answer is not None:
+        yield routed.answer
+        return
+    queued = time.perf_counter()
+    fallbacks = []
+    async with admission_controller.aslot(client_key):
+        add_stage('queue', (time.perf_counter() - queued) * 1000)
+        chunks = []
+        async for chunk in routed.chain.astream(routed.inputs, config=_run_config(affinity, fallbacks)):
+            chunks.append(chunk)
+            yield chunk
+    if not fallbacks:
+        await db_sync_to_async(store)(routed.route, "".join(chunks))
+
+
+async def astream_query_router(query: str, video_id: str, timestamp: float, chat_history: str, user_id: int | None, client_key: str | None = None, affinity: BackendAffinity | None = None):
+    """
+    stream_query_router for the ASGI endpoint. Routing (ORM, classification,
+    retrieval) runs in a worker thread; the LLM is awaited with `astream`, and
+    queueing for an LLM slot or behind an identical request holds no thread.
+    """
+    cached, store = await db_sync_to_async(_lookup_cached_answer)(query, video_id, timestamp, chat_history, user_id)
+    if cached is not None:
+        yield cached
+        return
+    if client_key is None:
+        client_key = f"user:{user_id}" if user_id is not None else "public"
+    key = flight_key(video_id, normalize_query(query), user_id, chat_history, parse_time(query, timestamp))
+    async for chunk in acoalesce(key, lambda: _agenerate_answer(query, video_id, timestamp, chat_history, user_id, client_key, store, affinity)):
+        yield chunk
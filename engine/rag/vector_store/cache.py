@@ -0,0 +1,128 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILES = ("index.faiss", "index.pkl")
+
+
+def get_index_version(index_path: str):
+    """
+    Returns a (mtime_ns, size) signature for the files of a saved FAISS index,
+    or None if the index is incomplete. A rewrite by the indexer (even from
+    another process) changes the signature, so stale entries are never served.
+    """
+    version = []
+    for name in INDEX_FILES:
+        try:
+            st = os.stat(os.path.join(index_path, name))
+        except OSError:
+            return None
+        version.append((st.st_mtime_ns, st.st_size))
+    return tuple(version)
+
+
+class VectorStoreCache:
+    """
+    Process-wide LRU cache of loaded FAISS vector stores keyed by index path.
+
+    Each entry remembers the on-disk version it was loaded from and its
+    approximate size (bytes of index.faiss + index.pkl). Entries are evicted
+    least-recently-used first once the total exceeds `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # index_path -> (version, size, store)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_load(self, index_path: str, loader):
+        """
+        Returns the cached store for `index_path`, calling `loader(index_path)`
+        on a miss or when the files on disk changed since the last load.
+        Returns None if the index files are missing.
+        """
+        index_path = os.path.normpath(index_path)
+        version = get_index_version(index_path)
+        if version is None:
+            self.invalidate(index_path)
+            return None
+
+        with self._lock:
+            entry = self._entries.get(index_path)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(index_path)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # Load outside the lock so a slow unpickle doesn't block other videos.
+        store = loader(index_path)
+        if store is None:
+            return None
+
+        size = sum(s for _, s in version)
+        with self._lock:
+            old = self._entries.pop(index_path, None)
+            if old is not None:
+                self._total_bytes -= old[1]
+            if size <= self.max_bytes:
+                self._entries[index_path] = (version, size, store)
+                self._total_bytes += size
+                self._evict_locked()
+            else:
+                logger.warning(f"FAISS index at {index_path} ({size} bytes) exceeds cache budget; not caching.")
+        return store
+
+    def invalidate(self, index_path: str):
+        """Drops the cached store for a single index directory."""
+        index_path = os.path.normpath(index_path)
+        with self._lock:
+            entry = self._entries.pop(index_path, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+                self.invalidations += 1
+                logger.debug(f"Invalidated cached FAISS store for {index_path}")
+
+    def invalidate_prefix(self, path_prefix: str):
+        """Drops every cached store under a directory, e.g. after a --wipe."""
+        path_prefix = os.path.normpath(path_prefix)
+        with self._lock:
+            for index_path in [p for p in self._entries if p == path_prefix or p.startswith(path_prefix + os.sep)]:
+                self._total_bytes -= self._entries.pop(index_path)[1]
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+
+    def _evict_locked(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            index_path, (_, size, _) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            logger.debug(f"Evicted FAISS store {index_path} from cache ({size} bytes)")
+
+
+vector_store_cache = VectorStoreCache(max_bytes=settings.FAISS_STORE_CACHE_MAX_BYTES)
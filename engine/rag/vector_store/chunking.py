@@ -0,0 +1,51 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def merge_into_time_windows(segments, window_seconds: float, overlap_seconds: float = 0.0, end_of_video: float = 0.0):
+    """
+    Merges consecutive timed caption rows into windows of roughly
+    `window_seconds`, with consecutive windows sharing `overlap_seconds`.
+
+    Args:
+        segments: Iterable of (start, content) pairs, sorted by start.
+        window_seconds: Target window length in seconds.
+        overlap_seconds: How far each window reaches back into the previous one.
+        end_of_video: Video duration, used as the end of the last window.
+
+    Returns:
+        List of dicts with 'start', 'end' and 'content' keys.
+    """
+    rows = [(float(start), content.strip()) for start, content in segments if content and content.strip()]
+    if not rows:
+        return []
+
+    overlap_seconds = min(max(overlap_seconds, 0.0), window_seconds / 2)
+    windows = []
+    i = 0
+    n = len(rows)
+    while i < n:
+        window_start = rows[i][0]
+        j = i + 1
+        while j < n and rows[j][0] < window_start + window_seconds:
+            j += 1
+
+        window_end = rows[j][0] if j < n else max(rows[-1][0], float(end_of_video or 0.0))
+        windows.append({
+            'start': window_start,
+            'end': window_end,
+            'content': " ".join(content for _, content in rows[i:j]),
+        })
+
+        if j >= n:
+            break
+
+        # Step back so the next window begins `overlap_seconds` before this one ended
+        next_i = j
+        while next_i - 1 > i and rows[next_i - 1][0] >= window_end - overlap_seconds:
+            next_i -= 1
+        i = next_i
+
+    logger.debug(f"Merged {n} rows into {len(windows)} time windows ({window_seconds}s, overlap {overlap_seconds}s).")
+    return windows
@@ -1,11 +1,59 @@
 import logging
+import threading
+from functools import lru_cache
 from django.conf import settings
-from langchain_ollama import OllamaEmbeddings
+from .embedding_cache import CachedEmbeddings, get_embedding_cache
+from ..ollama_pool import embedding_pool, PooledOllamaEmbeddings
 
 logger = logging.getLogger(__name__)
 
+@lru_cache(maxsize=None)
 def get_embeddings():
-    return OllamaEmbeddings(
+    """Shared embeddings clients (one per pool node), so their HTTP connections and the loaded model stay warm."""
+    return PooledOllamaEmbeddings(
+        embedding_pool,
         model=settings.OLLAMA_EMBEDDING_MODEL,
-        base_url=settings.OLLAMA_BASE_URL
-    )
\ No newline at end of file
+        keep_alive=settings.OLLAMA_KEEP_ALIVE
+    )
+
+
+_inflight_queries = {}
+_inflight_lock = threading.Lock()
+
+
+def embed_query_cached(text: str) -> tuple[float, ...]:
+    """
+    Query embedding memoised in-process, so the classifier and the retriever
+    share one embedding call for the same question (and repeats are free).
+    Concurrent callers for the same text wait for the first one's result
+    instead of embedding it again.
+    """
+    with _inflight_lock:
+        done = _inflight_queries.get(text)
+        owner = done is None
+        if owner:
+            done = _inflight_queries[text] = threading.Event()
+
+    if not owner:
+        done.wait(timeout=30)
+        return _embed_query_memo(text)
+
+    try:
+        return _embed_query_memo(text)
+    finally:
+        with _inflight_lock:
+            _inflight_queries.pop(text, None)
+        done.set()
+
+
+@lru_cache(maxsize=1024)
+def _embed_query_memo(text: str) -> tuple[float, ...]:
+    return tuple(get_embeddings().embed_query(text))
+
+
+def get_indexing_embeddings():
+    """Embeddings for index builders: chunk vectors go through the on-disk embedding cache."""
+    return CachedEmbeddings(
+        get_embeddings(),
+        get_embedding_cache(settings.OLLAMA_EMBEDDING_MODEL)
+    )
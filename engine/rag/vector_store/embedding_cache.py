@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import numpy as np
+from django.conf import settings
+from langchain_core.embeddings import Embeddings
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to the in-process lock only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+KEY_BYTES = 16
+
+
+def _text_key(model: str, text: str) -> bytes:
+    return hashlib.blake2b(f"{model}\0{text}".encode('utf-8'), digest_size=KEY_BYTES).digest()
+
+
+class EmbeddingCache:
+    """
+    Append-only, content-addressed store of embeddings for one model.
+
+    On disk (under EMBEDDING_CACHE_ROOT/<model>/):
+        vectors.f32  - row-major float32 matrix, memory-mapped for reads
+        keys.bin     - 16-byte blake2b digest of (model, text) per row
+        meta.json    - {"model": ..., "dim": ...}
+
+    Row i of vectors.f32 belongs to the i-th key in keys.bin. Writers take an
+    exclusive file lock so several Django-Q workers can share one cache.
+    """
+
+    def __init__(self, root: str, model: str):
+        self.model = model
+        self.dir = os.path.join(root, re.sub(r'[^A-Za-z0-9_.-]', '_', model))
+        self._keys_path = os.path.join(self.dir, 'keys.bin')
+        self._vectors_path = os.path.join(self.dir, 'vectors.f32')
+        self._meta_path = os.path.join(self.dir, 'meta.json')
+        self._lock_path = os.path.join(self.dir, '.lock')
+        self._lock = threading.Lock()
+        self._index = {}
+        self._rows = 0
+        self._dim = None
+        self._vectors = None
+
+    def get_many(self, texts: list[str]) -> list[list[float] | None]:
+        keys = [_text_key(self.model, t) for t in texts]
+        with self._lock:
+            if any(k not in self._index for k in keys):
+                # Another worker may have embedded these since we last looked
+                self._refresh_locked()
+            if not self._index:
+                return [None] * len(texts)
+            vectors = self._get_vectors_locked()
+            return [
+                vectors[self._index[k]].tolist() if k in self._index else None
+                for k in keys
+            ]
+
+    def put_many(self, texts: list[str], vectors: list[list[float]]):
+        if not texts:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        keys = [_text_key(self.model, t) for t in texts]
+
+        with self._lock:
+            os.makedirs(self.dir, exist_ok=True)
+            with open(self._lock_path, 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._refresh_locked()
+                    if self._dim is None:
+                        self._dim = matrix.shape[1]
+                        with open(self._meta_path, 'w') as f:
+                            json.dump({'model': self.model, 'dim': self._dim}, f)
+                    elif matrix.shape[1] != self._dim:
+                        raise ValueError(
+                            f"Embedding dim {matrix.shape[1]} does not match cache dim {self._dim} for {self.model}"
+                        )
+
+                    with open(self._vectors_path, 'ab') as f:
+                        # Drop any partial rows left by a writer that died mid-append
+                        f.truncate(self._rows * self._dim * 4)
+                        f.write(matrix.tobytes())
+                    with open(self._keys_path, 'ab') as f:
+                        f.truncate(self._rows * KEY_BYTES)
+                        f.write(b"".join(keys))
+
+                    for i, key in enumerate(keys):
+                        self._index[key] = self._rows + i
+                    self._rows += len(keys)
+                    self._vectors = None
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh_locked()
+            return self._rows
+
+    def _refresh_locked(self):
+        if self._dim is None and os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                self._dim = json.load(f)['dim']
+        if not os.path.exists(self._keys_path):
+            return
+
+        size = os.path.getsize(self._keys_path)
+        complete = size - size % KEY_BYTES
+        if complete <= self._rows * KEY_BYTES:
+            return
+
+        with open(self._keys_path, 'rb') as f:
+            f.seek(self._rows * KEY_BYTES)
+            data = f.read(complete - self._rows * KEY_BYTES)
+        for offset in range(0, len(data), KEY_BYTES):
+            self._index[data[offset:offset + KEY_BYTES]] = self._rows
+            self._rows += 1
+        self._vectors = None
+
+    def _get_vectors_locked(self):
+        if self._vectors is None or len(self._vectors) < self._rows:
+            self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(self._rows, self._dim))
+        return self._vectors
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an embeddings client so `embed_documents` is served from the
+    EmbeddingCache and only unseen chunk texts are sent to the model.
+    Queries are passed straight through.
+    """
+
+    def __init__(self, underlying: Embeddings, cache: EmbeddingCache):
+        self.underlying = underlying
+        self.cache = cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        vectors = self.cache.get_many(texts)
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        if missing:
+            new_vectors = self.underlying.embed_documents([texts[i] for i in missing])
+            self.cache.put_many([texts[i] for i in missing], new_vectors)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+        logger.info(f"Embedding cache ({self.cache.model}): {len(texts) - len(missing)} hits, {len(missing)} misses.")
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.underlying.embed_query(text)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(model: str) -> EmbeddingCache:
+    """Returns the process-wide EmbeddingCache for a model."""
+    with _caches_lock:
+        if model not in _caches:
+            _caches[model] = EmbeddingCache(settings.EMBEDDING_CACHE_ROOT, model)
+        return _caches[model]
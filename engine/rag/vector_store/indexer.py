@@ -5,7 +5,10 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
 from langchain.schema import Document
 from core.models import Transcript, OCRTranscript, Video, Course
-from .config import get_embeddings
+from .config import get_indexing_embeddings
+from .cache import vector_store_cache
+from .chunking import merge_into_time_windows
+from ..versions import bump_generation
 
 logger = logging.getLogger(__name__)
 
@@ -81,7 +84,7 @@ def _process_and_save_index(docs, platform_id, video, subfolder_name, status_fie
             video.save(update_fields=[status_field])
             return
 
-        embedding_function = get_embeddings()
+        embedding_function = get_indexing_embeddings()
 
         logger.info(f"Creating FAISS index from {len(split_docs)} chunks for video {platform_id} ({subfolder_name})...")
         vector_store = FAISS.from_documents(split_docs, embedding_function)
@@ -90,6 +93,8 @@ def _process_and_save_index(docs, platform_id, video, subfolder_name, status_fie
         os.makedirs(index_path, exist_ok=True)
 
         vector_store.save_local(index_path)
+        vector_store_cache.invalidate(index_path)
+        bump_generation(video.pk)
         logger.info(f"Successfully saved FAISS index for video {platform_id} to {index_path}")
 
         setattr(video, status_field, 'complete')
@@ -129,12 +134,23 @@ def create_index_for_single_video(video: Video):
             video.save(update_fields=['index_status'])
         return
 
+    # Captions are only a few seconds long; merge them into time windows so each
+    # vector carries a coherent passage instead of a single caption line.
+    windows = merge_into_time_windows(
+        transcripts.values_list('start', 'content'),
+        window_seconds=settings.TRANSCRIPT_CHUNK_WINDOW_SECONDS,
+        overlap_seconds=settings.TRANSCRIPT_CHUNK_OVERLAP_SECONDS,
+        end_of_video=video.duration
+    )
+    logger.info(f"Merged {transcripts.count()} transcript rows into {len(windows)} time windows for video {platform_id}.")
+
     docs = []
-    for t in transcripts:
+    for w in windows:
         docs.append(Document(
-            page_content=t.content,
+            page_content=w['content'],
             metadata={
-                'start_time': t.start,
+                'start_time': w['start'],
+                'end_time': w['end'],
                 'video_title': video.title,
                 'video_id': platform_id,
                 'course_title': video.course.title,
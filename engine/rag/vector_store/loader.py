@@ -3,10 +3,20 @@ import logging
 from django.conf import settings
 from langchain_community.vectorstores import FAISS
 from .config import get_embeddings
+from .cache import vector_store_cache
+from .note_store import NoteVectorStore
 
 logger = logging.getLogger(__name__)
 
 
+def _load_faiss(index_path: str):
+    return FAISS.load_local(
+        index_path,
+        get_embeddings(),
+        allow_dangerous_deserialization=True
+    )
+
+
 def get_transcript_vector_store(video_id: str):
     video_id = str(video_id)
     logger.debug(f"Attempting to load transcript vector store for video_id: {video_id}")
@@ -24,11 +34,7 @@ def get_transcript_vector_store(video_id: str):
 
     try:
         logger.debug(f"Loading transcript FAISS index from: {index_path}")
-        return FAISS.load_local(
-            index_path,
-            get_embeddings(),
-            allow_dangerous_deserialization=True
-        )
+        return vector_store_cache.get_or_load(index_path, _load_faiss)
     except Exception as e:
         logger.exception(f"Error loading transcript index for video {video_id}: {e}")
         return None
@@ -55,41 +61,23 @@ def get_ocr_vector_store(video_id: str):
 
     try:
         logger.debug(f"Loading OCR FAISS index from: {index_path}")
-        return FAISS.load_local(
-            index_path,
-            get_embeddings(),
-            allow_dangerous_deserialization=True
-        )
+        return vector_store_cache.get_or_load(index_path, _load_faiss)
     except Exception as e:
         logger.exception(f"Error loading OCR index for video {video_id}: {e}")
         return None
 
 
 def get_note_vector_store(video_id: str, user_id: int):
+    """
+    Builds an in-memory store from the embeddings saved on the user's Note rows.
+    """
     logger.debug(f"Attempting to load notes vector store for video_id: {video_id}, user_id: {user_id}")
 
-    index_path = os.path.join(
-        settings.FAISS_INDEX_ROOT,
-        'notes',
-        str(user_id),
-        video_id
-    )
-    if not os.path.exists(index_path):
-        logger.warning(f"No note index directory found for video {video_id}, user {user_id} at {index_path}")
-        return None
-
-    faiss_file = os.path.join(index_path, "index.faiss")
-    if not os.path.exists(faiss_file):
-        logger.warning(f"FAISS file 'index.faiss' not found within notes directory {index_path}")
-        return None
-
     try:
-        logger.debug(f"Loading notes FAISS index from: {index_path}")
-        return FAISS.load_local(
-            index_path,
-            get_embeddings(),
-            allow_dangerous_deserialization=True
-        )
+        store = NoteVectorStore.for_user_video(str(video_id), user_id)
+        if store is None:
+            logger.info(f"No embedded notes found for video {video_id}, user {user_id}")
+        return store
     except Exception as e:
-        logger.exception(f"Error loading notes index for video {video_id}, user {user_id}: {e}")
-        return None
\ No newline at end of file
+        logger.exception(f"Error loading notes for video {video_id}, user {user_id}: {e}")
+        return None
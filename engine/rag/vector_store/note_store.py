@@ -0,0 +1,63 @@
+import logging
+import numpy as np
+from django.db.models import Q
+from langchain_core.documents import Document
+from core.models import Note
+
+logger = logging.getLogger(__name__)
+
+
+class NoteVectorStore:
+    """
+    In-memory vector store over one user's notes for one video, built from
+    the embeddings stored on the Note rows. A user has at most a few dozen
+    notes per video, so exact brute-force L2 scoring in numpy is cheaper
+    than opening a FAISS index.
+    """
+
+    def __init__(self, documents: list[Document], matrix: np.ndarray):
+        self.documents = documents
+        self.matrix = matrix
+
+    @classmethod
+    def for_user_video(cls, video_id: str, user_id: int):
+        rows = list(
+            Note.objects.filter(
+                Q(video__youtube_id=video_id) | Q(video__vimeo_id=video_id),
+                user_id=user_id,
+                embedding__isnull=False
+            ).values_list('id', 'title', 'content', 'video_timestamp', 'course_id', 'video_id', 'embedding')
+        )
+        if not rows:
+            return None
+
+        documents = []
+        vectors = []
+        for note_id, title, content, timestamp, course_id, video_db_id, embedding in rows:
+            documents.append(Document(
+                page_content=f"Title: {title}\nContent: {content}",
+                metadata={
+                    "user_id": user_id,
+                    "note_id": note_id,
+                    "course_id": course_id,
+                    "video_db_id": video_db_id,
+                    "video_platform_id": video_id,
+                    "timestamp": timestamp,
+                    "type": "note"
+                }
+            ))
+            vectors.append(np.frombuffer(embedding, dtype=np.float32))
+
+        return cls(documents, np.vstack(vectors))
+
+    def similarity_search_with_score_by_vector(self, embedding: list[float], k: int = 4):
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[0] != self.matrix.shape[1]:
+            logger.warning(f"Note embedding dim {self.matrix.shape[1]} does not match query dim {query.shape[0]}; skipping notes.")
+            return []
+        distances = np.sum((self.matrix - query) ** 2, axis=1)
+        top = np.argsort(distances)[:k]
+        return [(self.documents[i], float(distances[i])) for i in top]
+
+    def similarity_search_by_vector(self, embedding: list[float], k: int = 4):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k)]
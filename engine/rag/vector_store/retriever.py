@@ -1,59 +1,160 @@
+import time
 import logging
-from langchain_community.vectorstores import FAISS
-from langchain.retrievers import EnsembleRetriever
-from .config import get_embeddings
-# Added get_ocr_vector_store to the imports
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Any
+from django.conf import settings
+from pydantic import Field
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from .config import embed_query_cached
+from ..tracing import span, add_stage
 from .loader import get_transcript_vector_store, get_note_vector_store, get_ocr_vector_store
 
 logger = logging.getLogger(__name__)
 
+# Reciprocal Rank Fusion constant (same default as LangChain's EnsembleRetriever)
+RRF_C = 60
+
+# Shared pool for fanning a query out to the per-video stores. Searches that
+# overrun their deadline keep running here but are no longer waited on.
+_search_executor = ThreadPoolExecutor(
+    max_workers=settings.RAG_SEARCH_WORKERS,
+    thread_name_prefix='rag-search'
+)
+
+
+@dataclass
+class RetrievalSource:
+    """A loaded store searched by vector, with its fusion weight, k and deadline (seconds)."""
+    name: str
+    store: Any
+    k: int
+    weight: float
+    deadline: float = 2.0
+
+
+def _timed_search(source: RetrievalSource, embedding: list[float]):
+    started = time.perf_counter()
+    results = source.store.similarity_search_with_score_by_vector(embedding, k=source.k)
+    # Copies, so the distance never ends up on the cached store's own documents
+    docs = [
+        Document(page_content=doc.page_content, metadata={**doc.metadata, 'score': float(score)})
+        for doc, score in results
+    ]
+    return docs, (time.perf_counter() - started) * 1000
+
+
+def weighted_reciprocal_rank(doc_lists: list[list[Document]], weights: list[float]) -> list[Document]:
+    """
+    Weighted Reciprocal Rank Fusion over several ranked lists.
+    Documents with identical content are collapsed and scored cumulatively.
+    """
+    rrf_score = defaultdict(float)
+    first_seen = {}
+    for doc_list, weight in zip(doc_lists, weights):
+        for rank, doc in enumerate(doc_list, start=1):
+            rrf_score[doc.page_content] += weight / (rank + RRF_C)
+            first_seen.setdefault(doc.page_content, doc)
+    return sorted(first_seen.values(), key=lambda d: rrf_score[d.page_content], reverse=True)
+
+
+class MultiStoreRetriever(BaseRetriever):
+    """
+    Embeds the question once and runs `similarity_search_with_score_by_vector`
+    against every source concurrently, then fuses the results with weighted
+    RRF. Each document's distance is kept in metadata['score'].
+    A source that errors or misses its deadline is dropped from the fusion.
+    With no sources it returns an empty context without calling the embedder.
+
+    After each search, `timings` maps source name to
+    {'ms': elapsed, 'status': 'ok' | 'timeout' | 'error', 'hits': n}.
+    """
+    sources: list[RetrievalSource]
+    timings: dict = Field(default_factory=dict)
+
+    def embed_query(self, query: str) -> list[float]:
+        return list(embed_query_cached(query))
+
+    def search_by_vector(self, embedding: list[float]) -> list[Document]:
+        started = time.perf_counter()
+        futures = [
+            (source, _search_executor.submit(_timed_search, source, embedding))
+            for source in self.sources
+        ]
+
+        doc_lists = []
+        weights = []
+        self.timings = {}
+        for source, future in futures:
+            remaining = source.deadline - (time.perf_counter() - started)
+            try:
+                docs, elapsed_ms = future.result(timeout=max(remaining, 0))
+                doc_lists.append(docs)
+                weights.append(source.weight)
+                self.timings[source.name] = {'ms': elapsed_ms, 'status': 'ok', 'hits': len(docs)}
+            except FutureTimeoutError:
+                logger.warning(f"{source.name} source missed its {source.deadline}s deadline; dropping it.")
+                self.timings[source.name] = {'ms': source.deadline * 1000, 'status': 'timeout', 'hits': 0}
+            except Exception as e:
+                logger.error(f"Search failed for {source.name} source: {e}")
+                self.timings[source.name] = {'ms': (time.perf_counter() - started) * 1000, 'status': 'error', 'hits': 0}
+
+        logger.info("Retrieval timings: " + ", ".join(
+            f"{name}={t['ms']:.1f}ms ({t['status']})" for name, t in self.timings.items()
+        ))
+        for name, t in self.timings.items():
+            add_stage(f"search_{name}", t['ms'])
+
+        if len(doc_lists) == 1:
+            return doc_lists[0]
+        return weighted_reciprocal_rank(doc_lists, weights)
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> list[Document]:
+        if not self.sources:
+            return []
+        with span('embed'):
+            embedding = self.embed_query(query)
+        return self.search_by_vector(embedding)
+
 
 def get_retriever(video_id: str, user_id: int | None):
     logger.debug(f"Getting retriever for video_id: {video_id}, user_id: {user_id}")
 
-    retrievers = []
-    weights = []
+    with span('load_indexes'):
+        return _build_retriever(video_id, user_id)
+
+
+def _build_retriever(video_id: str, user_id: int | None):
+    sources = []
+    deadlines = settings.RAG_SOURCE_DEADLINES
 
     # 1. Transcript Retriever (Audio) - Weight: 0.5
     transcript_store = get_transcript_vector_store(video_id)
     if transcript_store:
-        transcript_retriever = transcript_store.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-        retrievers.append(transcript_retriever)
-        weights.append(0.5)
+        sources.append(RetrievalSource('transcript', transcript_store, k=3, weight=0.5, deadline=deadlines['transcript']))
         logger.info(f"Loaded transcript retriever for video {video_id}")
-    
+
     # 2. OCR Retriever (Visual) - Weight: 0.2
     # This captures code on screen or slides that wasn't spoken aloud
     ocr_store = get_ocr_vector_store(video_id)
     if ocr_store:
-        ocr_retriever = ocr_store.as_retriever(search_type="similarity", search_kwargs={"k": 3})
-        retrievers.append(ocr_retriever)
-        weights.append(0.2)
+        sources.append(RetrievalSource('ocr', ocr_store, k=3, weight=0.2, deadline=deadlines['ocr']))
         logger.info(f"Loaded OCR retriever for video {video_id}")
 
     # 3. Note Retriever (User Personal) - Weight: 0.3
     if user_id is not None:
         note_store = get_note_vector_store(video_id, user_id)
         if note_store:
-            note_retriever = note_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}
-            )
-            retrievers.append(note_retriever)
-            weights.append(0.3)
+            sources.append(RetrievalSource('notes', note_store, k=5, weight=0.3, deadline=deadlines['notes']))
             logger.info(f"Loaded note retriever for video {video_id} for user {user_id}")
 
-    # --- Fallback & Return Logic ---
-
-    if not retrievers:
+    if not sources:
         logger.warning(f"Could not load any retrievers for video {video_id}. RAG will have no context.")
-        # Create a dummy retriever to prevent crashes
-        return FAISS.from_texts(["No context available for this video."], get_embeddings()).as_retriever(search_kwargs={"k": 1})
-
-    if len(retrievers) == 1:
-        logger.info(f"Using single retriever for video {video_id}")
-        return retrievers[0]
+    else:
+        weights = [s.weight for s in sources]
+        logger.info(f"Using {len(sources)} sources (Weights: {weights}) for video {video_id}")
 
-    logger.info(f"Using EnsembleRetriever with {len(retrievers)} sources (Weights: {weights}) for video {video_id}")
-    # Hybrid Search: Combines results using Reciprocal Rank Fusion (RRF) based on the weights provided
-    return EnsembleRetriever(retrievers=retrievers, weights=weights)
\ No newline at end of file
+    # Hybrid Search: one query embedding shared by all stores, fused with weighted RRF
+    return MultiStoreRetriever(sources=sources)
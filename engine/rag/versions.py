@@ -0,0 +1,47 @@
+import time
+from django.core.cache import cache
+from django.db.models import Count, Max
+from core.models import Transcript, OCRTranscript
+
+
+def _rows_version(queryset) -> str:
+    # Transcript writers delete and bulk-create a video's rows, so the row
+    # count plus the highest id changes on every rewrite.
+    stats = queryset.aggregate(n=Count('id'), last=Max('id'))
+    return f"{stats['n']}:{stats['last'] or 0}"
+
+
+def transcript_version(video) -> str:
+    """Cheap fingerprint of a video's Transcript rows."""
+    return _rows_version(Transcript.objects.filter(video=video))
+
+
+def ocr_version(video) -> str:
+    """Cheap fingerprint of a video's OCRTranscript rows."""
+    return _rows_version(OCRTranscript.objects.filter(video=video))
+
+
+def _generation_key(video_pk, user_id=None) -> str:
+    key = f"video-generation:{video_pk}"
+    return key if user_id is None else f"{key}:user:{user_id}"
+
+
+def bump_generation(video_pk, user_id=None):
+    """
+    Marks everything derived from a video's transcript, OCR or indexes (or,
+    with `user_id`, from one user's notes on it) as stale. The marker lives
+    in the shared Django cache, so in-process caches of every worker see it
+    on their next lookup without querying the database.
+    """
+    cache.set(_generation_key(video_pk, user_id), time.time_ns(), timeout=None)
+
+
+def current_generation(video_pk, user_id=None) -> int:
+    key = _generation_key(video_pk, user_id)
+    generation = cache.get(key)
+    if generation is None:
+        # First lookup since the cache was cleared: start a generation so
+        # anything cached before the clear is rebuilt once.
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
@@ -7,6 +7,11 @@ from .rag.vector_store.indexer import (
     create_ocr_index_for_single_video
 )
 from .rag.index_notes import update_video_notes_index
+from .rag.note_index_queue import claim_note_index_update
+from .rag.summarizer import build_video_summary
+from .rag.chapters import build_video_chapters
+from .rag.memory import fold_conversation_history
+from django_q.tasks import async_task
 from core.models import Note, Video
 from django.contrib.auth.models import User
 from django.db.models import Q
@@ -61,6 +66,20 @@ def task_process_new_video(vimeo_id: str):
             except Exception as e:
                 logger.error(f"Pipeline: OCR indexing failed for video {video.id}: {e}")
 
+        # --- Step 5: Stored summary (answers "summarize" questions without an LLM call) ---
+        logger.info(f"Pipeline: 4. Generating stored summary for video {video.id}")
+        try:
+            build_video_summary(video)
+        except Exception as e:
+            logger.error(f"Pipeline: Summary generation failed for video {video.id}: {e}")
+
+        # --- Step 6: Chapters (instant answers for time-based questions) ---
+        logger.info(f"Pipeline: 5. Segmenting video {video.id} into chapters")
+        try:
+            build_video_chapters(video)
+        except Exception as e:
+            logger.error(f"Pipeline: Chapter segmentation failed for video {video.id}: {e}")
+
         logger.info(f"Django-Q: NEW VIDEO pipeline FINISHED for video {video.id}.")
         
     except Video.DoesNotExist:
@@ -101,8 +120,17 @@ def task_generate_index(course_id: int):
         logger.error(f"Django-Q: Index task FAILED for course {course_id}. Log: {log}")
     else:
         logger.info(f"Django-Q: Index task SUCCESS for course {course_id}.")
+        for video_id in Video.objects.filter(course_id=course_id).values_list('id', flat=True):
+            async_task('engine.tasks.task_generate_video_summary', video_id)
+            async_task('engine.tasks.task_generate_video_chapters', video_id)
+
+def task_update_note_index(user_id: int, video_id: str, token: str | None = None, queued_at: float | None = None):
+    # Tasks scheduled through queue_note_index_update carry a token; a burst of
+    # saves collapses into the one task holding the current token.
+    if token is not None and not claim_note_index_update(user_id, video_id, token, queued_at):
+        logger.info(f"Django-Q : Deferring or skipping note index task for user {user_id}, video {video_id}")
+        return
 
-def task_update_note_index(user_id: int, video_id: str):
     try:
         logger.info(f"Django-Q : Starting note index update for user {user_id}, video {video_id}")
         user  = User.objects.get(id=user_id)
@@ -127,6 +155,35 @@ def task_update_note_index(user_id: int, video_id: str):
         except Exception:
             pass
 
+def task_generate_video_summary(video_id: int):
+    """Builds (or rebuilds) the stored hierarchical summary for a video."""
+    logger.info(f"Django-Q: Starting summary task for video {video_id}")
+    try:
+        video = Video.objects.get(id=video_id)
+        build_video_summary(video)
+        logger.info(f"Django-Q: Summary task SUCCESS for video {video_id}")
+    except Exception as e:
+        logger.error(f"Django-Q: Summary task FAILED for video {video_id}: {e}", exc_info=True)
+
+def task_generate_video_chapters(video_id: int):
+    """Segments a video into titled chapters for time-based questions."""
+    logger.info(f"Django-Q: Starting chapter task for video {video_id}")
+    try:
+        video = Video.objects.get(id=video_id)
+        build_video_chapters(video)
+        logger.info(f"Django-Q: Chapter task SUCCESS for video {video_id}")
+    except Exception as e:
+        logger.error(f"Django-Q: Chapter task FAILED for video {video_id}: {e}", exc_info=True)
+
+def task_fold_conversation_history(conversation_id: int):
+    """Folds a conversation's older turns into its rolling summary."""
+    logger.info(f"Django-Q: Starting history fold for conversation {conversation_id}")
+    try:
+        fold_conversation_history(conversation_id)
+        logger.info(f"Django-Q: History fold SUCCESS for conversation {conversation_id}")
+    except Exception as e:
+        logger.error(f"Django-Q: History fold FAILED for conversation {conversation_id}: {e}", exc_info=True)
+
 # --- NEW OCR SPECIFIC TASKS ---
 
 def task_process_video_ocr(video_id: int):
@@ -1,3 +1,458 @@
-from django.test import TestCase
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from django.test import SimpleTestCase, override_settings
+from engine.rag.ollama_pool import OllamaNode, OllamaPool, PooledChatOllama, NoBackendAvailable
+from engine.rag.single_flight import SingleFlight, AsyncSingleFlight, _across_processes
+from engine.rag.admission import AdmissionController, AdmissionRejected
 
-# Create your tests here.
+
+class StubOllama:
+    """
+    A local HTTP server answering the Ollama endpoints the pool uses:
+    /api/tags, /api/ps and a streamed /api/chat. With `failing` set, every
+    chat call gets a 500.
+    """
+
+    def __init__(self, name: str, models=('llama3.2:latest',)):
+        self.name = name
+        self.models = list(models)
+        self.failing = False
+        self.chat_calls = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, body):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path == '/api/tags':
+                    self._json(200, {'models': [{'name': m} for m in stub.models]})
+                elif self.path == '/api/ps':
+                    self._json(200, {'models': []})
+                else:
+                    self._json(404, {'error': 'not found'})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers['Content-Length']))
+                stub.chat_calls += 1
+                if stub.failing:
+                    return self._json(500, {'error': 'boom'})
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                for content, done in ((stub.name, False), ('', True)):
+                    line = {
+                        'model': 'llama3.2',
+                        'created_at': '2024-01-01T00:00:00Z',
+                        'message': {'role': 'assistant', 'content': content},
+                        'done': done,
+                    }
+                    if done:
+                        line['done_reason'] = 'stop'
+                    self.wfile.write((json.dumps(line) + '\n').encode())
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# Nothing listens on port 1, so connections are refused straight away
+UNREACHABLE_URL = 'http://127.0.0.1:1'
+
+
+@override_settings(
+    OLLAMA_HEALTH_INTERVAL_SECONDS=0,
+    OLLAMA_POOL_RETRIES=2,
+    OLLAMA_CIRCUIT_FAILURES=2,
+    OLLAMA_CIRCUIT_RESET_SECONDS=0.2,
+    OLLAMA_HEALTH_TIMEOUT_SECONDS=1,
+)
+class OllamaPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.stubs = []
+
+    def tearDown(self):
+        for stub in self.stubs:
+            stub.close()
+
+    def stub(self, name: str, **kwargs) -> StubOllama:
+        stub = StubOllama(name, **kwargs)
+        self.stubs.append(stub)
+        return stub
+
+    def ask(self, pool: OllamaPool) -> str:
+        return PooledChatOllama(pool, model='llama3.2', temperature=0).invoke('hi').content
+
+    def node_for(self, pool: OllamaPool, url: str) -> OllamaNode:
+        return next(n for n in pool.nodes if n.url == url)
+
+    def test_retries_on_another_node(self):
+        bad, good = self.stub('bad'), self.stub('good')
+        bad.failing = True
+        pool = OllamaPool('test', [bad.url, good.url])
+        for _ in range(3):
+            self.assertEqual(self.ask(pool), 'good')
+        self.assertGreaterEqual(bad.chat_calls, 1)
+        self.assertEqual(self.node_for(pool, bad.url).failures, bad.chat_calls)
+
+    def test_unreachable_node_is_retried_elsewhere(self):
+        good = self.stub('good')
+        pool = OllamaPool('test', [UNREACHABLE_URL, good.url])
+        for _ in range(3):
+            self.assertEqual(self.ask(pool), 'good')
+
+    def test_circuit_opens_then_half_opens(self):
+        stub = self.stub('only')
+        stub.failing = True
+        pool = OllamaPool('test', [stub.url], retries=0)
+        node = pool.nodes[0]
+
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                self.ask(pool)
+        self.assertEqual(node.state, 'open')
+        with self.assertRaises(NoBackendAvailable):
+            self.ask(pool)
+        self.assertEqual(stub.chat_calls, 2)
+
+        # A failed trial call reopens the circuit at once
+        time.sleep(0.25)
+        with self.assertRaises(Exception):
+            self.ask(pool)
+        self.assertEqual(node.state, 'open')
+        self.assertEqual(stub.chat_calls, 3)
+
+        # A successful trial call closes it
+        stub.failing = False
+        time.sleep(0.25)
+        self.assertEqual(self.ask(pool), 'only')
+        self.assertEqual(node.state, 'closed')
+
+    def test_half_open_lets_one_trial_through(self):
+        stub = self.stub('only')
+        pool = OllamaPool('test', [stub.url])
+        node = pool.nodes[0]
+        node.state = 'open'
+        node.opened_at = time.monotonic() - 1
+
+        with pool.node('llama3.2'):
+            self.assertEqual(node.state, 'half_open')
+            with self.assertRaises(NoBackendAvailable):
+                pool._pick('llama3.2', set())
+        self.assertEqual(node.state, 'closed')
+
+    def test_unhealthy_node_is_skipped(self):
+        good = self.stub('good')
+        pool = OllamaPool('test', [UNREACHABLE_URL, good.url])
+        pool.probe()
+        self.assertFalse(self.node_for(pool, UNREACHABLE_URL).healthy)
+        self.assertTrue(self.node_for(pool, good.url).healthy)
+
+        self.assertEqual(self.ask(pool), 'good')
+        self.assertEqual(self.node_for(pool, UNREACHABLE_URL).requests, 0)
+
+        good.close()
+        self.stubs.remove(good)
+        pool.probe()
+        with self.assertRaises(NoBackendAvailable):
+            self.ask(pool)
+
+    def test_prefers_nodes_with_the_model(self):
+        other = self.stub('other', models=['mistral:latest', 'llama3.2-vision:latest'])
+        right = self.stub('right', models=['llama3.2:latest'])
+        pool = OllamaPool('test', [other.url, right.url])
+        pool.probe()
+        for _ in range(3):
+            self.assertEqual(self.ask(pool), 'right')
+        self.assertEqual(other.chat_calls, 0)
+
+    def test_model_names_compare_with_implicit_latest_tag(self):
+        node = OllamaNode('http://ollama')
+        node.models = ['llama3.2:latest', 'qwen2.5:7b', 'registry.local:5000/team/phi3']
+        self.assertTrue(node.has_model('llama3.2'))
+        self.assertTrue(node.has_model('llama3.2:latest'))
+        self.assertTrue(node.has_model('qwen2.5:7b'))
+        self.assertTrue(node.has_model('registry.local:5000/team/phi3:latest'))
+        self.assertFalse(node.has_model('llama3'))
+        self.assertFalse(node.has_model('qwen2.5'))
+
+
+def wait_until(condition, timeout: float = 5.0):
+    give_up_at = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() >= give_up_at:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def gated_producer(self):
+        """A producer yielding 'a', then 'b' and 'c' once `gate` is set, counting its runs."""
+        gate = threading.Event()
+        runs = []
+
+        def produce():
+            runs.append(1)
+            yield 'a'
+            gate.wait(5)
+            yield 'b'
+            yield 'c'
+        return produce, gate, runs
+
+    def test_follower_replays_chunks_already_produced(self):
+        flights = SingleFlight(wait_seconds=5)
+        produce, gate, runs = self.gated_producer()
+        results = {}
+
+        owner = threading.Thread(target=lambda: results.update(owner=list(flights.stream('k', produce))))
+        owner.start()
+        wait_until(lambda: 'k' in flights._flights and flights._flights['k'].chunks)
+
+        follower = threading.Thread(target=lambda: results.update(follower=list(flights.stream('k', produce))))
+        follower.start()
+        wait_until(lambda: flights._flights['k'].followers == 1)
+        gate.set()
+        owner.join(5)
+        follower.join(5)
+
+        self.assertEqual(results, {'owner': ['a', 'b', 'c'], 'follower': ['a', 'b', 'c']})
+        self.assertEqual(len(runs), 1)
+        self.assertNotIn('k', flights._flights)
+
+    def test_owner_disconnecting_still_finishes_for_followers(self):
+        flights = SingleFlight(wait_seconds=5)
+        produce, gate, runs = self.gated_producer()
+        results = {}
+
+        owner = flights.stream('k', produce)
+        self.assertEqual(next(owner), 'a')
+        follower = threading.Thread(target=lambda: results.update(follower=list(flights.stream('k', produce))))
+        follower.start()
+        wait_until(lambda: flights._flights['k'].followers == 1)
+        gate.set()
+        owner.close()  # the owner's client went away after the first chunk
+        follower.join(5)
+
+        self.assertEqual(results, {'follower': ['a', 'b', 'c']})
+        self.assertEqual(len(runs), 1)
+
+    def test_follower_receives_the_owners_error(self):
+        flights = SingleFlight(wait_seconds=5)
+        gate = threading.Event()
+        errors = []
+
+        def produce():
+            yield 'a'
+            gate.wait(5)
+            raise ValueError('boom')
+
+        def consume():
+            try:
+                list(flights.stream('k', produce))
+            except ValueError as e:
+                errors.append(e)
+
+        owner = threading.Thread(target=consume)
+        owner.start()
+        wait_until(lambda: 'k' in flights._flights and flights._flights['k'].chunks)
+        follower = threading.Thread(target=consume)
+        follower.start()
+        wait_until(lambda: flights._flights['k'].followers == 1)
+        gate.set()
+        owner.join(5)
+        follower.join(5)
+        self.assertEqual(len(errors), 2)
+
+
+class AsyncSingleFlightTests(SimpleTestCase):
+
+    def test_first_caller_leaving_does_not_cut_the_answer_short(self):
+        flights = AsyncSingleFlight(wait_seconds=5)
+        runs = []
+
+        async def produce():
+            runs.append(1)
+            for chunk in ('a', 'b', 'c'):
+                await asyncio.sleep(0.01)
+                yield chunk
+
+        async def scenario():
+            first = flights.stream('k', produce)
+            self.assertEqual(await anext(first), 'a')
+            second = flights.stream('k', produce)
+            await first.aclose()
+            return [chunk async for chunk in second]
+
+        self.assertEqual(asyncio.run(scenario()), ['a', 'b', 'c'])
+        self.assertEqual(len(runs), 1)
+        self.assertEqual(flights._flights, {})
+
+
+def _generate_under_process_lock(lock_dir: str, marker: str, overlaps: str, rounds: int):
+    """Child process body: generates `rounds` times under the per-key flock, noting any overlap."""
+    def produce():
+        try:
+            fd = os.open(marker, os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            with open(overlaps, 'a') as f:
+                f.write(f"{os.getpid()}\n")
+            raise RuntimeError('another process is generating')
+        os.close(fd)
+        time.sleep(0.02)
+        os.remove(marker)
+        raise RuntimeError('failed before caching a result')
+        yield  # a generator, like the answer producers
+
+    with override_settings(SINGLE_FLIGHT_LOCK_DIR=lock_dir, SINGLE_FLIGHT_RESULT_TTL=30):
+        for _ in range(rounds):
+            try:
+                list(_across_processes('shared-key', produce, wait_seconds=10))
+            except RuntimeError:
+                pass
+
+
+class ProcessLockTests(SimpleTestCase):
+
+    def test_processes_sharing_a_key_never_generate_at_once(self):
+        # Every generation fails, so no result is cached and each waiter has
+        # to generate itself, one process at a time.
+        with tempfile.TemporaryDirectory() as tmp:
+            marker = os.path.join(tmp, 'generating')
+            overlaps = os.path.join(tmp, 'overlaps')
+            context = multiprocessing.get_context('fork')
+            workers = [
+                context.Process(target=_generate_under_process_lock, args=(os.path.join(tmp, 'locks'), marker, overlaps, 15))
+                for _ in range(4)
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join(60)
+                self.assertEqual(worker.exitcode, 0)
+            self.assertFalse(os.path.exists(overlaps), "two processes generated the same key at once")
+
+
+class AdmissionControllerTests(SimpleTestCase):
+
+    def queue_caller(self, controller: AdmissionController, client: str, name: str, order: list) -> threading.Thread:
+        """Starts a thread that waits for a slot as `client` and records `name` once admitted."""
+        queued = controller.stats()['queued']
+
+        def run():
+            with controller.slot(client):
+                order.append(name)
+        thread = threading.Thread(target=run)
+        thread.start()
+        wait_until(lambda: controller.stats()['queued'] == queued + 1)
+        return thread
+
+    def test_clients_are_served_round_robin(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=10, max_wait=5)
+        order = []
+        holder = controller.slot('holder')
+        holder.__enter__()
+        threads = [
+            self.queue_caller(controller, 'a', 'a1', order),
+            self.queue_caller(controller, 'a', 'a2', order),
+            self.queue_caller(controller, 'a', 'a3', order),
+            self.queue_caller(controller, 'b', 'b1', order),
+        ]
+        holder.__exit__(None, None, None)
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(order, ['a1', 'b1', 'a2', 'a3'])
+        stats = controller.stats()
+        self.assertEqual((stats['active'], stats['queued'], stats['admitted']), (0, 0, 5))
+
+    def test_full_queue_rejects_with_retry_after(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=1, max_wait=5)
+        order = []
+        holder = controller.slot('holder')
+        holder.__enter__()
+        waiting = self.queue_caller(controller, 'a', 'a1', order)
+
+        with self.assertRaises(AdmissionRejected) as rejected:
+            with controller.slot('b'):
+                pass
+        self.assertEqual(rejected.exception.reason, 'queue full')
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+        self.assertEqual(controller.stats()['rejected'], 1)
+
+        holder.__exit__(None, None, None)
+        waiting.join(5)
+        self.assertEqual(order, ['a1'])
+
+    def test_wait_timeout_rejects_and_leaves_the_queue(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=10, max_wait=0.1)
+        with controller.slot('holder'):
+            with self.assertRaises(AdmissionRejected) as rejected:
+                with controller.slot('a'):
+                    pass
+            self.assertEqual(rejected.exception.reason, 'wait timed out')
+            stats = controller.stats()
+            self.assertEqual((stats['queued'], stats['queued_clients'], stats['timed_out']), (0, 0, 1))
+        self.assertEqual(controller.stats()['active'], 0)
+
+    def test_cancelled_async_waiter_leaves_the_queue(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=10, max_wait=5)
+
+        async def wait_for_slot():
+            async with controller.aslot('a'):
+                await asyncio.sleep(10)
+
+        async def scenario():
+            async with controller.aslot('holder'):
+                waiter = asyncio.create_task(wait_for_slot())
+                while controller.stats()['queued'] == 0:
+                    await asyncio.sleep(0.01)
+                waiter.cancel()
+                await asyncio.gather(waiter, return_exceptions=True)
+                self.assertEqual(controller.stats()['queued'], 0)
+
+        asyncio.run(scenario())
+        self.assertEqual(controller.stats()['active'], 0)
+
+    def test_cancelled_async_waiter_hands_back_a_granted_slot(self):
+        controller = AdmissionController(max_concurrent=1, max_queue=10, max_wait=5)
+
+        async def wait_for_slot():
+            async with controller.aslot('a'):
+                await asyncio.sleep(10)
+
+        async def scenario():
+            holder = controller.aslot('holder')
+            await holder.__aenter__()
+            waiter = asyncio.create_task(wait_for_slot())
+            while controller.stats()['queued'] == 0:
+                await asyncio.sleep(0.01)
+            # The slot is handed to the waiter, which is cancelled before it runs
+            await holder.__aexit__(None, None, None)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+
+        asyncio.run(scenario())
+        stats = controller.stats()
+        self.assertEqual((stats['active'], stats['queued'], stats['admitted']), (0, 0, 2))
+        with controller.slot('b'):
+            self.assertEqual(controller.stats()['active'], 1)
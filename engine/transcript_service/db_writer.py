@@ -4,6 +4,7 @@ import pandas as pd
 import logging
 from django.conf import settings
 from core.models import Transcript
+from engine.rag.timeline import invalidate_video_timeline
 from .utils import sanitize_filename
 
 logger = logging.getLogger(__name__)
@@ -60,6 +61,7 @@ def save_and_populate_transcript(video, transcript_data, log_list):
         
         # Bulk create new entries
         Transcript.objects.bulk_create(transcripts_to_create)
+        invalidate_video_timeline(video.pk)
         log_list.append(f'  -> SUCCESS: Populated database with {len(transcripts_to_create)} lines.')
         
     except Exception as e:
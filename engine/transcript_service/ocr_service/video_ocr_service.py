@@ -4,6 +4,7 @@ import csv
 from typing import List, Dict
 from django.conf import settings
 from core.models import Video, OCRTranscript
+from engine.rag.timeline import invalidate_video_timeline
 from .frame_extractor import FrameExtractor
 from .ocr_extractor import OCRExtractor
 from .text_processor import TextProcessor
@@ -151,6 +152,7 @@ class VideoOCRService:
                 ) for entry in unique_entries
             ]
             OCRTranscript.objects.bulk_create(entries_to_create)
+            invalidate_video_timeline(video.pk)
             logger.info(f"VideoOCRService: Saved {len(entries_to_create)} records to Database.")
 
             # 2. File System Update (CSV)
@@ -1,14 +1,17 @@
 from django.urls import path
-from .views import api_assistant, api_course, api_transcript
+from .views import api_assistant, api_assistant_async, api_course, api_transcript
 
 urlpatterns = [
     path('api/roadmap/<int:course_id>/', api_course.roadmap_view, name='roadmap'),
     path('api/enroll/<int:course_id>/', api_course.enroll_view, name='enroll'),
     
     path('api/assistant/', api_assistant.AssistantAPIView.as_view(), name='assistant_api'),
+    path('api/assistant/async/', api_assistant_async.assistant_async_view, name='assistant_async_api'),
+    path('api/assistant/metrics/', api_assistant.AssistantMetricsAPIView.as_view(), name='assistant_metrics_api'),
     path( 'api/public/assistant/', api_assistant.PublicAssistantAPIView.as_view(), name='public_assiatant_api'),
 
     path('api/transcripts/<str:video_id>/', api_transcript.get_transcript_view, name='api_get_transcripts'),
+    path('api/transcripts/<str:video_id>/window/', api_transcript.get_timeline_window_view, name='api_timeline_window'),
     
     path('api/courses/add/', api_course.create_course_view, name='add_course'),
     path('api/courses/delete/<int:course_id>/', api_course.delete_course_view, name='delete_course'),
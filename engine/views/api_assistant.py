@@ -1,18 +1,93 @@
+import json
 import logging
+from itertools import chain
 from django.shortcuts import get_object_or_404
 from django.db.models import Q 
+from django.http import StreamingHttpResponse
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from core.models import Video, Conversation, ConversationMessage
-from engine.rag.utils import query_router
+from engine.rag.utils import query_router, stream_query_router
+from engine.rag.memory import build_chat_history
+from engine.rag.admission import AdmissionRejected, admission_controller
+from engine.rag.answer_cache import answer_cache
+from engine.rag.vector_store.cache import vector_store_cache
+from engine.rag.ollama_pool import chat_pool, embedding_pool, BackendAffinity
+from engine.rag.tracing import start_trace, finish_trace, span, annotate
+from engine.rag.instant import instant_snippets, format_snippets
 
 logger = logging.getLogger(__name__)
 
+
+def _sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def _flag(value, default: bool = False) -> bool:
+    """
+    A boolean request option. Form and query values arrive as strings, so
+    only True and 'true'/'1'/'on'/'yes' count as set ('false' and '0' don't).
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('true', '1', 'on', 'yes')
+
+
+def _event_stream_response(events):
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let a reverse proxy buffer the tokens
+    return response
+
+
+def _busy_response(e: AdmissionRejected):
+    logger.warning(f"Rejecting assistant request: {e}")
+    return Response(
+        {'error': 'The assistant is busy right now. Please try again shortly.', 'retry_after': e.retry_after},
+        status=status.HTTP_429_TOO_MANY_REQUESTS,
+        headers={'Retry-After': str(e.retry_after)}
+    )
+
+
+def _finish(trace, response):
+    """Server-Timing and the request record for a complete response; streams finish their own."""
+    if trace is None:
+        return response
+    trace.annotate(status=response.status_code)
+    if isinstance(response, StreamingHttpResponse):
+        response['Server-Timing'] = trace.server_timing()  # stages up to the first token
+    else:
+        finish_trace(trace, response)
+    return response
+
+
+def _save_message(conversation, query, answer, affinity: BackendAffinity | None = None):
+    ConversationMessage.objects.create(
+        conversation=conversation,
+        query=query,
+        answer=answer
+    )
+    if conversation.title == "New Conversation":
+        conversation.title = query[:255]
+        conversation.save(update_fields=['title'])
+        logger.info(f"Updated conversation {conversation.id} title to: {conversation.title}")
+    if affinity is not None and affinity.changed:
+        # The next turn goes to the Ollama node that has this prompt prefix cached
+        conversation.llm_backend = affinity.url
+        conversation.save(update_fields=['llm_backend'])
+
+
 class AssistantAPIView(APIView):
 
     def post(self, request, *args, **kwargs):
+        trace = start_trace('assistant')
+        return _finish(trace, self._answer(request, trace))
+
+    def _answer(self, request, trace):
         query = request.data.get('query')
         video_id_from_request = request.data.get('video_id')
 
@@ -26,6 +101,11 @@ class AssistantAPIView(APIView):
 
         conversation_id = request.data.get('conversation_id')
         force_new = request.data.get('force_new', False)
+        stream = _flag(request.data.get('stream'))
+        # 'instant': answer at once with timestamped snippets from the vector
+        # search; the LLM answer follows only if `with_answer` (default: when streaming)
+        instant = request.data.get('mode') == 'instant'
+        with_answer = _flag(request.data.get('with_answer'), default=stream)
 
         if not query or not video_id_from_request:
             logger.error(f"Missing query ('{query}') or video_id ('{video_id_from_request}') in request.")
@@ -35,19 +115,21 @@ class AssistantAPIView(APIView):
             )
 
         is_dummy_start_query = (force_new and query == "Start")
+        annotate(video_id=video_id_from_request, user_id=request.user.id, stream=stream)
 
         try:
             user = request.user
 
             logger.info(f"Attempting to find Video with youtube_id OR vimeo_id = '{video_id_from_request}'")
             # FIXED: Used Video.objects.get() instead of get_object_or_404 to correctly catch DoesNotExist
-            video = Video.objects.get(
-                Q(youtube_id=video_id_from_request) | Q(vimeo_id=video_id_from_request)
-            )
+            with span('lookup'):
+                video = Video.objects.get(
+                    Q(youtube_id=video_id_from_request) | Q(vimeo_id=video_id_from_request)
+                )
             logger.info(f"Successfully found video: {video.title} (DB ID: {video.pk})")
 
             conversation = None
-            chat_history_messages = []
+            chat_history = ""
 
             if conversation_id and not force_new:
                 try:
@@ -61,11 +143,8 @@ class AssistantAPIView(APIView):
 
             if conversation:
                 logger.info(f"Using existing conversation {conversation.id} for video {video_id_from_request}")
-                messages = conversation.messages.all().order_by('timestamp')
-                for msg in messages:
-                    chat_history_messages.append(f"User: {msg.query}")
-                    if msg.answer:
-                       chat_history_messages.append(f"Assistant: {msg.answer}")
+                with span('history'):
+                    chat_history = build_chat_history(conversation)
 
             if not conversation:
                 initial_title = "New Conversation"
@@ -80,36 +159,56 @@ class AssistantAPIView(APIView):
                 )
                 logger.info(f"Created new conversation {conversation.id} for video {video_id_from_request} with title: {initial_title}")
 
-            chat_history = "\n".join(chat_history_messages)
+            snippets = None
+            if instant and not is_dummy_start_query:
+                annotate(mode='instant', with_answer=with_answer)
+                with span('instant'):
+                    snippets = instant_snippets(query, video_id_from_request, user.id)
 
-            if not is_dummy_start_query:
-                logger.debug(f"Calling query_router for query: '{query}' on video {video_id_from_request}")
-                answer = query_router(
+            if stream and not is_dummy_start_query:
+                logger.debug(f"Streaming query_router for query: '{query}' on video {video_id_from_request}")
+                events = self._stream_answer(
                     query=query,
                     video_id=video_id_from_request,
                     timestamp=timestamp,
                     chat_history=chat_history,
-                    user_id=user.id
+                    user=user,
+                    conversation=conversation,
+                    trace=trace,
+                    snippets=snippets,
+                    with_answer=with_answer
                 )
+                # Pull the first event here so a saturated LLM still gets a proper 429
+                first_event = next(events)
+                return _event_stream_response(chain([first_event], events))
 
-                ConversationMessage.objects.create(
-                    conversation=conversation,
+            if snippets is not None and not with_answer:
+                answer = format_snippets(snippets)
+                _save_message(conversation, query, answer)
+            elif not is_dummy_start_query:
+                logger.debug(f"Calling query_router for query: '{query}' on video {video_id_from_request}")
+                affinity = BackendAffinity(conversation.llm_backend)
+                answer = query_router(
                     query=query,
-                    answer=answer
+                    video_id=video_id_from_request,
+                    timestamp=timestamp,
+                    chat_history=chat_history,
+                    user_id=user.id,
+                    client_key=f"user:{user.id}",
+                    affinity=affinity
                 )
 
-                if conversation.title == "New Conversation":
-                    conversation.title = query[:255]
-                    conversation.save(update_fields=['title'])
-                    logger.info(f"Updated conversation {conversation.id} title to: {conversation.title}")
+                _save_message(conversation, query, answer, affinity)
             else:
                 answer = "Starting new chat..."
 
-            return Response({
-                'answer': answer,
-                'conversation_id': conversation.id
-            }, status=status.HTTP_200_OK)
+            payload = {'answer': answer, 'conversation_id': conversation.id}
+            if snippets is not None:
+                payload['snippets'] = snippets
+            return Response(payload, status=status.HTTP_200_OK)
 
+        except AdmissionRejected as e:
+            return _busy_response(e)
         except Video.DoesNotExist:
              logger.error(f"Video with youtube_id OR vimeo_id '{video_id_from_request}' not found in database.", exc_info=False)
              return Response(
@@ -125,11 +224,68 @@ class AssistantAPIView(APIView):
                 error_context,
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
-        
+
+    def _stream_answer(self, query, video_id, timestamp, chat_history, user, conversation, trace=None, snippets=None, with_answer=True):
+        """
+        Yields Server-Sent Events: a `snippets` event first in instant mode,
+        one `token` event per chunk of the LLM answer (unless `with_answer` is
+        off), then `done` once the answer has been saved as a
+        ConversationMessage. The request record is logged when the stream ends.
+        """
+        if snippets is not None:
+            yield _sse('snippets', {'snippets': snippets})
+            if not with_answer:
+                _save_message(conversation, query, format_snippets(snippets))
+                yield _sse('done', {'conversation_id': conversation.id})
+                finish_trace(trace)
+                return
+
+        chunks = []
+        affinity = BackendAffinity(conversation.llm_backend)
+        try:
+            for chunk in stream_query_router(
+                query=query,
+                video_id=video_id,
+                timestamp=timestamp,
+                chat_history=chat_history,
+                user_id=user.id,
+                client_key=f"user:{user.id}",
+                affinity=affinity
+            ):
+                if chunk:
+                    chunks.append(chunk)
+                    yield _sse('token', {'token': chunk})
+        except AdmissionRejected as e:
+            if not chunks and snippets is None:
+                raise  # nothing sent yet: the view answers with a 429
+            if not chunks:
+                # The user has the snippets; keep them as this turn's answer
+                _save_message(conversation, query, format_snippets(snippets))
+            yield _sse('error', {'error': 'The assistant is busy right now. Please try again shortly.', 'retry_after': e.retry_after})
+            finish_trace(trace)
+            return
+        except Exception as e:
+            logger.error(f"Streaming answer failed for conversation {conversation.id}: {e}", exc_info=True)
+            yield _sse('error', {'error': 'An error occurred processing your request.'})
+            if trace is not None:
+                trace.annotate(error=str(e))
+                finish_trace(trace)
+            return
+
+        _save_message(conversation, query, "".join(chunks), affinity)
+
+        yield _sse('done', {'conversation_id': conversation.id})
+        finish_trace(trace)
+
+
 class PublicAssistantAPIView(APIView):
     permission_classes = [AllowAny]
 
-    def post(self, request,*args, **kwargs):
+    def post(self, request, *args, **kwargs):
+        trace = start_trace('public_assistant')
+        return _finish(trace, self._answer(request))
+
+    def _answer(self, request):
         query = request.data.get('query')
         video_id_from_prompt_request = request.data.get('video_id')
 
@@ -137,6 +293,8 @@ class PublicAssistantAPIView(APIView):
             logger.error(f"[Public Api] : Missing query {query} or videoId {video_id_from_prompt_request} in request")
             return Response({'error':'Query and Video Id required'}, status = status.HTTP_400_BAD_REQUEST)
         
+        annotate(video_id=video_id_from_prompt_request)
+
         try:
             logger.info(f"[Public API] : Trying to find video with youtube_id or vimeo_id : {video_id_from_prompt_request}")
             
@@ -145,10 +303,26 @@ class PublicAssistantAPIView(APIView):
             logger.info(f"[Public API] : Found video : {video.title} (DB ID: {video.pk})")
             logger.debug(f"[Public API] : Calling query_router for : {query} on video {video_id_from_prompt_request}")
 
-            answer = query_router(query = query , video_id= video_id_from_prompt_request, timestamp= 0.0, chat_history='', user_id = None)
+            if request.data.get('mode') == 'instant':
+                annotate(mode='instant')
+                with span('instant'):
+                    snippets = instant_snippets(query, video_id_from_prompt_request, None)
+                if not _flag(request.data.get('with_answer')):
+                    return Response({'answer': format_snippets(snippets), 'snippets': snippets, 'conversation_id': None}, status=status.HTTP_200_OK)
+            else:
+                snippets = None
 
-            return Response({'answer' : answer, 'conversation_id' : None}, status=status.HTTP_200_OK)
+            client_key = f"ip:{request.META.get('REMOTE_ADDR')}"
+            answer = query_router(query = query , video_id= video_id_from_prompt_request, timestamp= 0.0, chat_history='', user_id = None, client_key = client_key)
+
+            payload = {'answer' : answer, 'conversation_id' : None}
+            if snippets is not None:
+                payload['snippets'] = snippets
+            return Response(payload, status=status.HTTP_200_OK)
         
+        except AdmissionRejected as e:
+            return _busy_response(e)
+
         except Video.DoesNotExist:
             logger.error(f"[Public API] : Video with youtube_id or vimeo_id '{video_id_from_prompt_request}' not found", exc_info=False)
             return Response({'error': f'Video with Id {video_id_from_prompt_request} not found.' },status=status.HTTP_404_NOT_FOUND)
@@ -156,4 +330,17 @@ class PublicAssistantAPIView(APIView):
         except Exception as e :
             logger.error(f"[Public API] : An error occurred : {e}", exc_info=True)
 
-            return Response({'error' : 'An error occurred processing your request.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({'error' : 'An error occurred processing your request.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class AssistantMetricsAPIView(APIView):
+    """LLM admission, answer cache, FAISS store cache and Ollama node counters of this worker process, for staff."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'admission': admission_controller.stats(),
+            'answer_cache': answer_cache.stats(),
+            'vector_stores': vector_store_cache.stats(),
+            'ollama': {'chat': chat_pool.stats(), 'embedding': embedding_pool.stats()},
+        }, status=status.HTTP_200_OK)
@@ -0,0 +1,221 @@
+import json
+import asyncio
+import logging
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
+from core.models import Video, Conversation, ConversationMessage
+from engine.rag.utils import astream_query_router, db_sync_to_async
+from engine.rag.memory import build_chat_history
+from engine.rag.admission import AdmissionRejected
+from engine.rag.ollama_pool import BackendAffinity
+from engine.rag.tracing import start_trace, finish_trace, span, annotate
+from engine.rag.instant import instant_snippets, format_snippets
+from .api_assistant import _sse, _finish, _flag
+
+logger = logging.getLogger(__name__)
+
+# Message writes scheduled after the response; referenced so they aren't garbage collected
+_background_writes = set()
+
+BUSY_MESSAGE = 'The assistant is busy right now. Please try again shortly.'
+
+
+def _busy_response(e: AdmissionRejected) -> JsonResponse:
+    logger.warning(f"Rejecting assistant request: {e}")
+    response = JsonResponse({'error': BUSY_MESSAGE, 'retry_after': e.retry_after}, status=429)
+    response['Retry-After'] = str(e.retry_after)
+    return response
+
+
+async def _save_message(conversation: Conversation, query: str, answer: str, affinity: BackendAffinity | None):
+    await ConversationMessage.objects.acreate(conversation=conversation, query=query, answer=answer)
+    if conversation.title == "New Conversation":
+        await Conversation.objects.filter(pk=conversation.pk).aupdate(title=query[:255])
+        logger.info(f"Updated conversation {conversation.id} title to: {query[:255]}")
+    if affinity is not None and affinity.changed:
+        await Conversation.objects.filter(pk=conversation.pk).aupdate(llm_backend=affinity.url)
+
+
+def _save_after_response(conversation: Conversation, query: str, answer: str, affinity: BackendAffinity | None = None):
+    task = asyncio.get_running_loop().create_task(_save_message(conversation, query, answer, affinity))
+    _background_writes.add(task)
+
+    def done(t):
+        _background_writes.discard(t)
+        if not t.cancelled() and t.exception():
+            logger.error(f"Saving message for conversation {conversation.id} failed: {t.exception()}")
+    task.add_done_callback(done)
+
+
+async def _get_conversation(user, video: Video, conversation_id, force_new: bool, initial_title: str):
+    """Same selection as AssistantAPIView: the requested one, else the latest, else a new one."""
+    conversation = None
+    if conversation_id and not force_new:
+        try:
+            conversation = await Conversation.objects.aget(id=conversation_id, user=user, video=video)
+        except Conversation.DoesNotExist:
+            logger.warning(f"Conversation ID {conversation_id} not found for user {user.id}. Will create new or find latest.")
+
+    if not conversation and not force_new:
+        conversation = await Conversation.objects.filter(user=user, video=video).order_by('-created_at').afirst()
+
+    if conversation:
+        return conversation, True
+
+    conversation = await Conversation.objects.acreate(
+        user=user,
+        video=video,
+        course_id=video.course_id,
+        title=initial_title
+    )
+    logger.info(f"Created new conversation {conversation.id} for video {video.pk} with title: {initial_title}")
+    return conversation, False
+
+
+async def _stream_events(answer_chunks, conversation: Conversation, query: str, affinity: BackendAffinity, trace=None, snippets=None):
+    if snippets is not None:
+        yield _sse('snippets', {'snippets': snippets})
+        if answer_chunks is None:
+            _save_after_response(conversation, query, format_snippets(snippets))
+            yield _sse('done', {'conversation_id': conversation.id})
+            finish_trace(trace)
+            return
+
+    chunks = []
+    try:
+        async for chunk in answer_chunks:
+            if chunk:
+                chunks.append(chunk)
+                yield _sse('token', {'token': chunk})
+    except AdmissionRejected as e:
+        if not chunks and snippets is None:
+            raise  # nothing sent yet: the view answers with a 429
+        if not chunks:
+            _save_after_response(conversation, query, format_snippets(snippets))
+        yield _sse('error', {'error': BUSY_MESSAGE, 'retry_after': e.retry_after})
+        finish_trace(trace)
+        return
+    except Exception as e:
+        logger.error(f"Streaming answer failed for conversation {conversation.id}: {e}", exc_info=True)
+        yield _sse('error', {'error': 'An error occurred processing your request.'})
+        if trace is not None:
+            trace.annotate(error=str(e))
+            finish_trace(trace)
+        return
+
+    _save_after_response(conversation, query, "".join(chunks), affinity)
+    yield _sse('done', {'conversation_id': conversation.id})
+    finish_trace(trace)
+
+
+async def _prepend(first, rest):
+    yield first
+    async for item in rest:
+        yield item
+
+
+@require_POST
+async def assistant_async_view(request):
+    """
+    Async counterpart of AssistantAPIView, for serving under ASGI
+    (incuisenix.asgi). Accepts the same JSON body and returns the same JSON
+    or Server-Sent Events. Waiting on the LLM holds no thread, and the
+    ConversationMessage is written after the answer has been sent.
+    """
+    trace = start_trace('assistant_async')
+    return _finish(trace, await _answer(request, trace))
+
+
+async def _answer(request, trace):
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'error': 'Authentication required.'}, status=401)
+
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({'error': 'Request body must be JSON.'}, status=400)
+
+    query = data.get('query')
+    video_id = data.get('video_id')
+    try:
+        timestamp = float(data.get('timestamp') or 0.0)
+    except (TypeError, ValueError):
+        timestamp = 0.0
+    conversation_id = data.get('conversation_id')
+    force_new = data.get('force_new', False)
+    stream = _flag(data.get('stream'))
+    instant = data.get('mode') == 'instant'
+    with_answer = _flag(data.get('with_answer'), default=stream)
+
+    if not query or not video_id:
+        logger.error(f"Missing query ('{query}') or video_id ('{video_id}') in request.")
+        return JsonResponse({'error': 'Query and video_id are required.'}, status=400)
+
+    is_dummy_start_query = (force_new and query == "Start")
+    annotate(video_id=video_id, user_id=user.id, stream=stream)
+
+    try:
+        with span('lookup'):
+            video = await Video.objects.aget(Q(youtube_id=video_id) | Q(vimeo_id=video_id))
+    except Video.DoesNotExist:
+        logger.error(f"Video with youtube_id OR vimeo_id '{video_id}' not found in database.")
+        return JsonResponse({'error': f'Video with ID {video_id} not found.'}, status=404)
+
+    try:
+        initial_title = "New Conversation" if is_dummy_start_query else query[:255]
+        conversation, existing = await _get_conversation(user, video, conversation_id, force_new, initial_title)
+
+        if is_dummy_start_query:
+            return JsonResponse({'answer': "Starting new chat...", 'conversation_id': conversation.id})
+
+        chat_history = ""
+        if existing:
+            with span('history'):
+                chat_history = await sync_to_async(build_chat_history)(conversation)
+        snippets = None
+        if instant:
+            annotate(mode='instant', with_answer=with_answer)
+            with span('instant'):
+                snippets = await db_sync_to_async(instant_snippets)(query, video_id, user.id)
+            if not stream and not with_answer:
+                answer = format_snippets(snippets)
+                _save_after_response(conversation, query, answer)
+                return JsonResponse({'answer': answer, 'snippets': snippets, 'conversation_id': conversation.id})
+
+        affinity = BackendAffinity(conversation.llm_backend)
+        answer_chunks = None
+        if snippets is None or with_answer:
+            answer_chunks = astream_query_router(
+                query=query,
+                video_id=video_id,
+                timestamp=timestamp,
+                chat_history=chat_history,
+                user_id=user.id,
+                client_key=f"user:{user.id}",
+                affinity=affinity
+            )
+
+        if stream:
+            events = _stream_events(answer_chunks, conversation, query, affinity, trace, snippets)
+            # Pull the first event here so a saturated LLM still gets a proper 429
+            first_event = await anext(events)
+            response = StreamingHttpResponse(_prepend(first_event, events), content_type='text/event-stream')
+            response['Cache-Control'] = 'no-cache'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+
+        answer = "".join([chunk async for chunk in answer_chunks])
+        _save_after_response(conversation, query, answer, affinity)
+        payload = {'answer': answer, 'conversation_id': conversation.id}
+        if snippets is not None:
+            payload['snippets'] = snippets
+        return JsonResponse(payload)
+
+    except AdmissionRejected as e:
+        return _busy_response(e)
+    except Exception as e:
+        logger.error(f"An error occurred in assistant_async_view: {e}", exc_info=True)
+        return JsonResponse({'error': 'An error occurred processing your request.', 'video_id': video_id}, status=500)
@@ -12,6 +12,7 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.views import APIView
 from engine.transcript_service.utils import sanitize_filename
+from engine.rag.timeline import get_video_timeline
 from django_q.tasks import async_task
 
 logger = logging.getLogger(__name__)
@@ -181,4 +182,38 @@ def get_transcript_view(request, video_id):
 
     except Exception as e:
         logger.error(f"Error fetching transcript for video platform ID '{video_id}': {e}", exc_info=True)
-        return JsonResponse({'error': 'An internal server error occurred.'}, status=500)
\ No newline at end of file
+        return JsonResponse({'error': 'An internal server error occurred.'}, status=500)
+
+@login_required
+def get_timeline_window_view(request, video_id):
+    """
+    Transcript and OCR segments around a playback position, served from the
+    in-memory timeline. Query params: t (seconds), before and after (seconds,
+    default TIME_CONTEXT_BEFORE_SECONDS / TIME_CONTEXT_AFTER_SECONDS).
+    """
+    try:
+        seconds = float(request.GET.get('t', 0))
+        before = float(request.GET.get('before', settings.TIME_CONTEXT_BEFORE_SECONDS))
+        after = float(request.GET.get('after', settings.TIME_CONTEXT_AFTER_SECONDS))
+    except ValueError:
+        return JsonResponse({'error': "t, before and after must be numbers."}, status=400)
+
+    try:
+        video = get_object_or_404(
+            Video,
+            Q(youtube_id=video_id) | Q(vimeo_id=video_id)
+        )
+        timeline = get_video_timeline(video)
+        return JsonResponse({
+            'time': seconds,
+            'current': timeline.transcript.segment_at(seconds),
+            'segments': timeline.window(seconds, before, after),
+        })
+
+    except Http404:
+        logger.error(f"Video with youtube_id or vimeo_id '{video_id}' not found.")
+        return JsonResponse({'error': f"Video with ID '{video_id}' not found."}, status=404)
+
+    except Exception as e:
+        logger.error(f"Error fetching timeline window for video platform ID '{video_id}': {e}", exc_info=True)
+        return JsonResponse({'error': 'An internal server error occurred.'}, status=500)
@@ -34,6 +34,27 @@ SECRET_KEY = os.getenv('SECRET_KEY')
 OLLAMA_BASE_URL = os.getenv('OLLAMA_BASE_URL', 'http://localhost:11434')
 OLLAMA_MODEL = "llama3.2"
 OLLAMA_EMBEDDING_MODEL = "nomic-embed-text"
+# Smaller, faster model for short answers (classification, small talk) and
+# as the fallback when a route's budget runs out
+OLLAMA_SMALL_MODEL = os.getenv('OLLAMA_SMALL_MODEL', 'llama3.2:1b')
+# How long Ollama keeps a model loaded after a request, in seconds (-1 = forever).
+# An int, since OllamaEmbeddings rejects duration strings like "30m".
+OLLAMA_KEEP_ALIVE = int(os.getenv('OLLAMA_KEEP_ALIVE', 1800))
+
+# Ollama backend pool: comma-separated endpoints for chat models and for
+# embeddings (defaults to the chat pool), retries on another node, circuit
+# breaker (consecutive failures to open, seconds before a trial call) and
+# background health probes (seconds between probes; 0 disables them)
+OLLAMA_BASE_URLS = [u.strip() for u in os.getenv('OLLAMA_BASE_URLS', OLLAMA_BASE_URL).split(',') if u.strip()]
+OLLAMA_EMBEDDING_BASE_URLS = [u.strip() for u in os.getenv('OLLAMA_EMBEDDING_BASE_URLS', ','.join(OLLAMA_BASE_URLS)).split(',') if u.strip()]
+OLLAMA_POOL_RETRIES = 2
+OLLAMA_CIRCUIT_FAILURES = 3
+OLLAMA_CIRCUIT_RESET_SECONDS = 30
+OLLAMA_HEALTH_INTERVAL_SECONDS = int(os.getenv('OLLAMA_HEALTH_INTERVAL_SECONDS', 15))
+OLLAMA_HEALTH_TIMEOUT_SECONDS = 2
+# A conversation's follow-ups stay on the node that has its prompt prefix
+# cached unless that node has more than this many extra calls in flight
+OLLAMA_AFFINITY_SLACK = 1
 
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
@@ -84,6 +105,9 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'incuisenix.wsgi.application'
+# Serves api/assistant/async/ without pinning a worker per waiting request,
+# e.g. `uvicorn incuisenix.asgi:application`
+ASGI_APPLICATION = 'incuisenix.asgi.application'
 
 
 # Database
@@ -157,6 +181,117 @@ LOGIN_URL = 'home'
 
 FAISS_INDEX_ROOT = os.path.join(BASE_DIR, 'faiss_indexes/')
 
+# In-process LRU cache of loaded FAISS stores (approximate bytes on disk)
+FAISS_STORE_CACHE_MAX_BYTES = int(os.getenv('FAISS_STORE_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Content-addressed cache of chunk embeddings shared by all index builders
+EMBEDDING_CACHE_ROOT = os.path.join(BASE_DIR, 'embedding_cache/')
+
+# Note index updates for the same (user, video) are coalesced until saves go quiet
+NOTE_INDEX_QUIET_SECONDS = 5
+NOTE_INDEX_MAX_WAIT_SECONDS = 30
+
+# Local query classifier: minimum top-1 vs top-2 centroid similarity margin
+# before the answer is trusted without asking the LLM classifier
+QUERY_CLASSIFIER_MIN_MARGIN = 0.03
+
+# Start retrieval for a question while it is still being classified
+RAG_SPECULATIVE_RETRIEVAL = True
+RAG_SPECULATION_WORKERS = int(os.getenv('RAG_SPECULATION_WORKERS', 4))
+
+# Transcript rows are merged into time windows before embedding
+TRANSCRIPT_CHUNK_WINDOW_SECONDS = 45
+TRANSCRIPT_CHUNK_OVERLAP_SECONDS = 10
+
+# Hierarchical video summaries: section length, combine fan-in, parallel LLM calls
+SUMMARY_CHUNK_SECONDS = 300
+SUMMARY_REDUCE_FANIN = 6
+SUMMARY_MAX_CONCURRENCY = 2
+# Until the stored summary exists, summary questions are answered from evenly
+# spaced transcript excerpts of at most this many estimated tokens in total
+SUMMARY_SAMPLE_TOKENS = 3000
+
+# Chapter segmentation: window size, minimum chapter length, and how far (in
+# standard deviations) adjacent-window similarity must dip to start a chapter
+CHAPTER_WINDOW_SECONDS = 30
+CHAPTER_MIN_SECONDS = 120
+CHAPTER_BOUNDARY_STD = 0.5
+
+# Parallel retrieval: worker threads and per-source latency deadlines (seconds)
+RAG_SEARCH_WORKERS = int(os.getenv('RAG_SEARCH_WORKERS', 8))
+RAG_SOURCE_DEADLINES = {
+    'transcript': 2.0,
+    'ocr': 1.0,
+    'notes': 1.0,
+}
+
+# Context packing for the RAG prompt: estimated-token budget, distance jump
+# that ends a source's results (adaptive k), and near-duplicate thresholds
+RAG_CONTEXT_TOKEN_BUDGET = 1200
+RAG_SCORE_GAP = 0.15
+RAG_DEDUPE_JACCARD = 0.7
+RAG_DEDUPE_CONTAINMENT = 0.9
+
+# Reuse generated answers for the same or paraphrased question on a video
+# (cosine similarity of the question embeddings); per worker process
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_MIN_SIMILARITY = 0.95
+ANSWER_CACHE_TTL_SECONDS = 24 * 3600
+ANSWER_CACHE_MAX_ENTRIES = 5000
+
+# Identical questions arriving while one is being answered share its
+# generation: 'off', 'thread' (within a worker) or 'file' (across workers
+# on this host, via flock). Followers give up after SINGLE_FLIGHT_WAIT_SECONDS
+# without output; other workers reuse a finished answer for RESULT_TTL seconds.
+SINGLE_FLIGHT_MODE = os.getenv('SINGLE_FLIGHT_MODE', 'thread')
+SINGLE_FLIGHT_WAIT_SECONDS = 120
+SINGLE_FLIGHT_RESULT_TTL = 30
+SINGLE_FLIGHT_LOCK_DIR = os.path.join(BASE_DIR, 'single_flight_locks')
+
+# LLM admission control, per worker process: concurrent generations (keep
+# workers x LLM_MAX_CONCURRENCY near Ollama's OLLAMA_NUM_PARALLEL), callers
+# allowed to wait, and how long they wait before getting a 429
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', 2))
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', 16))
+LLM_MAX_QUEUE_WAIT_SECONDS = 60
+
+# Time-based questions: in-process timelines kept per worker, and how much
+# transcript/OCR around the asked-about moment goes into the prompt (seconds)
+VIDEO_TIMELINE_CACHE_SIZE = 64
+TIME_CONTEXT_BEFORE_SECONDS = 20
+TIME_CONTEXT_AFTER_SECONDS = 20
+
+# Chat memory: recent turns sent verbatim, total history budget (estimated
+# tokens), and the rolling summary that older turns are folded into
+CHAT_HISTORY_MAX_TURNS = 6
+CHAT_HISTORY_TOKEN_BUDGET = 1500
+CHAT_SUMMARY_MAX_TOKENS = 300
+CHAT_HISTORY_FOLD_BATCH = 20
+
+# Per-stage request tracing (Server-Timing header plus one JSON record per
+# request on the 'engine.rag.trace' logger): fraction of requests traced
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))
+
+# Per-route LLM: model, generation caps (num_predict = max answer tokens,
+# num_ctx = context window) and budget_seconds, the wall-clock budget for the
+# whole answer (None = no budget). Without a first token within half of it
+# the route switches to LLM_FALLBACK_MODEL; past it the call is cut off.
+# 'background' covers summaries, chapters and chat-memory folding in tasks.
+LLM_ROUTES = {
+    'classifier': {'model': OLLAMA_SMALL_MODEL, 'num_predict': 16, 'num_ctx': 2048, 'budget_seconds': 5},
+    'general': {'model': OLLAMA_SMALL_MODEL, 'num_predict': 256, 'num_ctx': 2048, 'budget_seconds': 15},
+    'rag': {'model': OLLAMA_MODEL, 'num_predict': 512, 'num_ctx': 4096, 'budget_seconds': 30},
+    'time': {'model': OLLAMA_MODEL, 'num_predict': 384, 'num_ctx': 4096, 'budget_seconds': 30},
+    'summary': {'model': OLLAMA_MODEL, 'num_predict': 768, 'num_ctx': 8192, 'budget_seconds': 45},
+    'background': {'model': OLLAMA_MODEL, 'num_predict': 1024, 'num_ctx': 8192, 'budget_seconds': None},
+}
+LLM_FALLBACK_MODEL = os.getenv('LLM_FALLBACK_MODEL', OLLAMA_SMALL_MODEL)
+
+# Instant answers (mode 'instant'): how many timestamped snippets from the
+# vector search are returned, and their length in estimated tokens
+INSTANT_SNIPPET_COUNT = 3
+INSTANT_SNIPPET_TOKENS = 80
+
 # --- Django Q Configuration ---
 
 Q_CLUSTER = {
@@ -47,6 +47,9 @@ export async function submitQuery(query, timestamp, options = {}) {
   };
   if (options.forceNew) {
     requestData.force_new = true;
+  } else {
+    // Ask for Server-Sent Events so tokens render as soon as they are generated
+    requestData.stream = true;
   }
 
   try {
@@ -59,6 +62,12 @@ export async function submitQuery(query, timestamp, options = {}) {
       body: JSON.stringify(requestData),
     });
 
+    const contentType = response.headers.get("Content-Type") || "";
+    if (response.ok && contentType.startsWith("text/event-stream")) {
+      await renderEventStream(response, currentState);
+      return;
+    }
+
     removeLoadingIndicator();
 
     if (!response.ok) {
@@ -97,4 +106,58 @@ export async function submitQuery(query, timestamp, options = {}) {
       "assistant"
     );
   }
-}
\ No newline at end of file
+}
+
+async function renderEventStream(response, currentState) {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let answer = "";
+  let messageEl = null;
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let eventName = "message";
+      let data = "";
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event:")) eventName = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      const payload = data ? JSON.parse(data) : {};
+
+      if (eventName === "token") {
+        if (!messageEl) {
+          removeLoadingIndicator();
+          messageEl = DomUtils.appendStreamingMessage();
+        }
+        answer += payload.token;
+        DomUtils.updateStreamingMessage(messageEl, answer);
+      } else if (eventName === "done") {
+        if (payload.conversation_id && currentState.currentVideoId) {
+          State.setActiveConversation(
+            currentState.currentVideoId,
+            payload.conversation_id
+          );
+        }
+      } else if (eventName === "error") {
+        throw new Error(payload.error || "The assistant stopped responding.");
+      }
+    }
+  }
+
+  removeLoadingIndicator();
+  if (!answer) {
+    DomUtils.appendMessage(
+      "Sorry, an error occurred. The assistant did not provide a valid answer.",
+      "assistant"
+    );
+  }
+}
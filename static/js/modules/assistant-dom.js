@@ -64,6 +64,26 @@ export function appendMessage(message, sender) {
   box.scrollTop = box.scrollHeight;
 }
 
+// Creates an empty assistant message that is filled in as tokens stream in
+export function appendStreamingMessage() {
+  const box = getChatBoxElement();
+  if (!box) return null;
+
+  const messageElement = document.createElement("div");
+  messageElement.classList.add("chat-message", "assistant");
+  box.appendChild(messageElement);
+  box.scrollTop = box.scrollHeight;
+  return messageElement;
+}
+
+export function updateStreamingMessage(messageElement, text) {
+  if (!messageElement) return;
+  messageElement.innerHTML = converter.makeHtml(String(text));
+
+  const box = getChatBoxElement();
+  if (box) box.scrollTop = box.scrollHeight;
+}
+
 export function clearChatBox() {
   const box = getChatBoxElement();
   if (box) {